@@ -0,0 +1,340 @@
+"""Query backends behind the dashboard's filters, charts and table.
+
+PandasBackend answers from the loaded frame through the cube, the bitmap
+index and the table view. DuckDBBackend runs the same queries as SQL over the
+Parquet partition store, multi-threaded, reading only the columns and row
+groups a query needs, so the range is never loaded into memory; it needs the
+optional duckdb package. BI_BACKEND picks one ("pandas" or "duckdb").
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bitmaps import FilterIndex
+from cache import footprint
+from churn import Activity, activity
+from cube import DIMENSIONS, Cube
+from data import PARTITION_KEY, SCHEMA
+from export import EXPORT_ROWS, take_chunks
+from metrics import stage
+from panels import Panels, aggregate, hourly
+from sketch import Sketches
+from store import DAY_COLUMN, PartitionStore
+from table import TableView
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+BACKEND = os.environ.get("BI_BACKEND", "pandas")
+
+# Bytes of backends kept built, frames and their indexes included.
+BACKEND_CACHE_BYTES = int(os.environ.get("BI_BACKEND_CACHE_MB", 2048)) << 20
+
+SQL_TYPES = {"datetime64[us]": "TIMESTAMP", "int64": "BIGINT",
+             "float64": "DOUBLE", "category": "VARCHAR"}
+
+
+@dataclass(frozen=True)
+class Query:
+    """A table selection: sidebar filters, a column search and an order."""
+    filters: dict
+    sort_by: str | None = None
+    descending: bool = False
+    column: str | None = None
+    text: str = ""
+
+    def key(self) -> tuple:
+        return (tuple(self.filters.get(c) for c in DIMENSIONS), self.sort_by,
+                self.descending, self.column, self.text)
+
+
+class Backend(ABC):
+    """What the dashboard asks of the data for one version of a range."""
+    version: str
+    rows: int
+    columns: list[str]
+
+    @property
+    @abstractmethod
+    def nbytes(self) -> int:
+        """Memory held, for the backend cache's budget."""
+
+    @abstractmethod
+    def options(self, column: str) -> list:
+        """Values of a filter dimension present in the range, sorted."""
+
+    @abstractmethod
+    def panels(self, filters: dict, approximate: bool = False) -> Panels:
+        """Every panel of the selection; approximate estimates the distinct
+        subscribers and top subscribers instead of counting them."""
+
+    @abstractmethod
+    def hourly(self, filters: dict) -> pd.Series:
+        """Connections of the selection per hour."""
+
+    @abstractmethod
+    def activity(self, filters: dict, until: date) -> Activity:
+        """Active base per day and churn per month, up to until, of the
+        subscriptions connected within the range (see Activity)."""
+
+    @abstractmethod
+    def count(self, query: Query) -> int:
+        """Rows of the table selection."""
+
+    @abstractmethod
+    def page(self, query: Query, number: int, size: int) -> pd.DataFrame:
+        """Page number (from 0) of the selection, size rows long."""
+
+    @abstractmethod
+    def chunks(self, query: Query) -> Iterator[pd.DataFrame]:
+        """Every row of the selection, in order, EXPORT_ROWS at a time."""
+
+
+class PandasBackend(Backend):
+    def __init__(self, version: str, df: pd.DataFrame):
+        self.version, self.df, self.rows = version, df, len(df)
+        with stage("cube_build"):
+            self.cube = Cube(df)
+        with stage("index_build"):
+            self.index = FilterIndex(df)
+        self.table = TableView(df)
+        self.columns = self.table.columns
+        self._sketches: Sketches | None = None
+        self._selection: tuple[tuple, np.ndarray] | None = None
+        self._lock = threading.Lock()
+
+    def options(self, column: str) -> list:
+        return self.cube.options(column)
+
+    @property
+    def nbytes(self) -> int:
+        selection = self._selection
+        return (footprint(self.df) + self.cube.nbytes + self.index.nbytes
+                + self.table.nbytes
+                + (self._sketches.nbytes if self._sketches is not None else 0)
+                + (selection[1].nbytes if selection is not None else 0))
+
+    def sketches(self) -> Sketches:
+        """Built on the first approximate query."""
+        with self._lock:
+            if self._sketches is None:
+                with stage("sketch_build"):
+                    self._sketches = Sketches(self.df, self.cube)
+            return self._sketches
+
+    def panels(self, filters: dict, approximate: bool = False) -> Panels:
+        return aggregate(self.df, self.cube, self.index, filters,
+                         sketches=self.sketches() if approximate else None)
+
+    def hourly(self, filters: dict) -> pd.Series:
+        return hourly(self.df, self.index.positions(filters))
+
+    def activity(self, filters: dict, until: date) -> Activity:
+        rows = self.index.positions(filters)
+        return activity(self.df["subscriber_id"].cat.codes.to_numpy()[rows],
+                        self.df["connection_date"].to_numpy()[rows],
+                        self.df["disconnection_date"].to_numpy()[rows], until)
+
+    def _rows(self, query: Query) -> np.ndarray:
+        """Row positions of the selection; the last one is kept for paging."""
+        key = query.key()
+        with self._lock:
+            if self._selection is not None and self._selection[0] == key:
+                return self._selection[1]
+        rows = self.table.rows(self.index.positions(query.filters),
+                               query.sort_by, query.descending,
+                               query.column, query.text)
+        with self._lock:
+            self._selection = (key, rows)
+        return rows
+
+    def count(self, query: Query) -> int:
+        return len(self._rows(query))
+
+    def page(self, query: Query, number: int, size: int) -> pd.DataFrame:
+        return self.table.page(self._rows(query), number, size)
+
+    def chunks(self, query: Query) -> Iterator[pd.DataFrame]:
+        return take_chunks(self.df, self._rows(query), self.columns)
+
+
+class DuckDBBackend(Backend):
+    """SQL over the store's month files covering the range.
+
+    The PartitionCache must have refreshed the range (see its `version`), so
+    that the store holds every day of it.
+    """
+
+    def __init__(self, version: str, store: PartitionStore, date_from: date,
+                 date_to: date):
+        if duckdb is None:
+            raise RuntimeError("BI_BACKEND=duckdb needs the duckdb package")
+        self.version = version
+        self.columns = list(SCHEMA)
+        months, month = [], date_from.replace(day=1)
+        while month <= date_to:
+            months.append(month)
+            month = (month + timedelta(days=32)).replace(day=1)
+        files = [str(store.path(m)) for m in months if store.path(m).exists()]
+        if files:
+            source = ("read_parquet([" + ", ".join(
+                "'" + f.replace("'", "''") + "'" for f in files)
+                + "], file_row_number = true, filename = true)")
+        else:
+            source = "(SELECT " + ", ".join(
+                f'NULL::{SQL_TYPES[t]} AS "{c}"' for c, t in SCHEMA.items()) \
+                + f", NULL::DATE AS {DAY_COLUMN}" \
+                + ", '' AS filename, 0::BIGINT AS file_row_number WHERE false)"
+        # The partitions the rows were filed under, as the pandas backend
+        # assembles them, not the rows' own dates.
+        self._con = duckdb.connect()
+        self._con.execute(
+            f"CREATE VIEW subscriptions AS "
+            f"SELECT * EXCLUDE ({DAY_COLUMN}) FROM {source} "
+            f"WHERE {DAY_COLUMN} BETWEEN DATE '{date_from}' "
+            f"AND DATE '{date_to}'")
+        self.rows = self._scalar("SELECT count(*) FROM subscriptions")
+
+    @property
+    def nbytes(self) -> int:
+        # The data stays in the store; this is DuckDB's own buffer memory.
+        return int(self._scalar(
+            "SELECT coalesce(sum(memory_usage_bytes), 0) FROM duckdb_memory()"))
+
+    def _query(self, sql: str, params: list | None = None):
+        # A cursor per call: the connection is shared across script threads.
+        return self._con.cursor().execute(sql, params or [])
+
+    def _scalar(self, sql: str, params: list | None = None):
+        return self._query(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _where(filters: dict, *extra: str) -> tuple[str, list]:
+        terms = [f'"{c}" = ?' for c in filters] + list(extra)
+        where = "WHERE " + " AND ".join(terms) if terms else ""
+        return where, list(filters.values())
+
+    def _counts(self, expr: str, filters: dict, order: str,
+                name: str, value: str = "count(*)") -> pd.Series:
+        where, params = self._where(filters, f"{expr} IS NOT NULL")
+        df = self._query(f"SELECT {expr} AS k, {value} AS v FROM subscriptions "
+                         f"{where} GROUP BY k ORDER BY {order}", params).df()
+        out = pd.Series(df["v"].to_numpy(), index=pd.Index(df["k"], name=name),
+                        name="count")
+        return out if value != "count(*)" else out.astype(np.int64)
+
+    def options(self, column: str) -> list:
+        return [r[0] for r in self._query(
+            f'SELECT DISTINCT "{column}" FROM subscriptions '
+            f'WHERE "{column}" IS NOT NULL ORDER BY 1').fetchall()]
+
+    def panels(self, filters: dict, approximate: bool = False) -> Panels:
+        # DuckDB's own HyperLogLog; the top-10 stays exact, one grouped scan.
+        distinct = ("approx_count_distinct(subscriber_id)" if approximate
+                    else "count(DISTINCT subscriber_id)")
+        where, params = self._where(filters)
+        rows, subs, amount, bonus = self._query(
+            f"SELECT count(*), {distinct}, "
+            f"coalesce(sum(amount), 0), avg(procent_bonus_id) "
+            f"FROM subscriptions {where}", params).fetchone()
+        month = "strftime(connection_date, '%Y-%m')"
+        ranked = "v DESC, k"
+        where_top, params_top = self._where(
+            filters, "subscriber_id IS NOT NULL", "subscriber_name IS NOT NULL")
+        top = self._query(
+            f"SELECT subscriber_id, subscriber_name, count(*) AS count "
+            f"FROM subscriptions {where_top} GROUP BY ALL "
+            f"ORDER BY count DESC, subscriber_id, subscriber_name LIMIT 10",
+            params_top).df()
+        daily = self._counts("connection_date::DATE", filters, "k", "day")
+        daily.index = pd.DatetimeIndex(daily.index, name="day")
+        return Panels(
+            rows=int(rows),
+            unique_subs=int(subs),
+            total_amount=float(amount),
+            avg_bonus=float("nan") if bonus is None else float(bonus),
+            monthly=self._counts(month, filters, "k", "month"),
+            amount_monthly=self._counts(month, filters, "k", "month",
+                                        "sum(amount)").rename("amount"),
+            daily=daily,
+            tariffs=self._counts("provaider_tariff_name", filters, ranked,
+                                 "provaider_tariff_name"),
+            cities=self._counts("city_id", filters, ranked, "city_id"),
+            types=self._counts("subscription_type", filters, ranked,
+                               "subscription_type"),
+            managers=self._counts("manager_id", filters, ranked, "manager_id"),
+            billing=self._counts("billing_period", filters, ranked,
+                                 "billing_period"),
+            bonus=self._counts("procent_bonus_id", filters, "k",
+                               "procent_bonus_id"),
+            weekdays=self._counts("isodow(connection_date) - 1", filters, "k",
+                                  "weekday").reindex(range(7), fill_value=0),
+            top=top,
+            approximate=approximate,
+        )
+
+    def hourly(self, filters: dict) -> pd.Series:
+        counts = self._counts(f"date_trunc('hour', \"{PARTITION_KEY}\")",
+                              filters, "k", "hour")
+        if counts.empty:
+            return counts
+        hours = pd.date_range(counts.index.min(), counts.index.max(), freq="h",
+                              name="hour")
+        return counts.reindex(hours, fill_value=0)
+
+    def activity(self, filters: dict, until: date) -> Activity:
+        # Only the three columns the sweep needs leave the database.
+        where, params = self._where(filters)
+        df = self._query(f"SELECT subscriber_id, connection_date, "
+                         f"disconnection_date FROM subscriptions {where}",
+                         params).df()
+        codes, _ = pd.factorize(df["subscriber_id"])
+        return activity(codes, df["connection_date"].to_numpy("datetime64[us]"),
+                        df["disconnection_date"].to_numpy("datetime64[us]"),
+                        until)
+
+    def _select(self, query: Query) -> tuple[str, str, list]:
+        """WHERE and ORDER BY clauses of a table query, with parameters."""
+        extra, search = [], []
+        if query.column and query.text:
+            if query.column not in self.columns:
+                raise ValueError(f"unknown column {query.column!r}")
+            extra.append(f'contains(lower(CAST("{query.column}" AS VARCHAR)), ?)')
+            search.append(query.text.lower())
+        where, params = self._where(query.filters, *extra)
+        order = "filename, file_row_number"
+        if query.sort_by is not None:
+            if query.sort_by not in self.columns:
+                raise ValueError(f"unknown column {query.sort_by!r}")
+            direction = "DESC" if query.descending else "ASC"
+            order = f'"{query.sort_by}" {direction} NULLS LAST, {order}'
+        return where, order, params + search
+
+    def count(self, query: Query) -> int:
+        where, _, params = self._select(query)
+        return self._scalar(f"SELECT count(*) FROM subscriptions {where}", params)
+
+    def _sql(self, query: Query) -> tuple[str, list]:
+        where, order, params = self._select(query)
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        return (f"SELECT {columns} FROM subscriptions {where} ORDER BY {order}",
+                params)
+
+    def page(self, query: Query, number: int, size: int) -> pd.DataFrame:
+        sql, params = self._sql(query)
+        return self._query(f"{sql} LIMIT ? OFFSET ?",
+                           params + [size, number * size]).df()
+
+    def chunks(self, query: Query) -> Iterator[pd.DataFrame]:
+        sql, params = self._sql(query)
+        reader = self._query(sql, params).fetch_record_batch(EXPORT_ROWS)
+        for batch in reader:
+            yield batch.to_pandas()
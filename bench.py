@@ -0,0 +1,227 @@
+"""Headless benchmark of the dashboard pipeline on synthetic data.
+
+    python bench.py --rows 100000 1000000 10000000
+    python bench.py --rows 1000000 --compare   # flag regressions vs. last run
+
+Every stage the page goes through is timed (best of --repeat) and, in a
+separate pass, measured for peak traced allocations. Results are appended to
+benchmarks/results.jsonl, one line per (rows, stage), tagged with the commit.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+import charts
+import synth
+from bitmaps import FilterIndex, distinct, top_pairs
+from cache import SizedLRU
+from churn import activity
+from cube import Cube
+from data import concat, iter_records, normalize
+from panels import aggregate
+from sketch import Sketches
+
+RESULTS = Path(os.environ.get("BI_BENCH_RESULTS", "benchmarks/results.jsonl"))
+CHUNK_ROWS = 200_000
+PIECE = 1 << 16
+
+
+class Recorder:
+    def __init__(self, rows: int, repeat: int, memory: bool):
+        self.rows, self.repeat, self.memory = rows, repeat, memory
+        self.results: list[dict] = []
+
+    def add(self, stage: str, seconds: float, peak: int | None):
+        self.results.append({"rows": self.rows, "stage": stage,
+                             "seconds": round(seconds, 6),
+                             "peak_mib": None if peak is None
+                             else round(peak / 2 ** 20, 2)})
+
+    def run(self, stage: str, fn):
+        """Time fn (best of repeat), then measure its peak allocations once."""
+        best = float("inf")
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            out = fn()
+            best = min(best, time.perf_counter() - start)
+        peak = None
+        if self.memory:
+            del out
+            tracemalloc.start()
+            out = fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.add(stage, best, peak)
+        return out
+
+
+def ingest(rows: int, memory: bool) -> tuple[float, float, int, int, pd.DataFrame]:
+    """Decode and coerce a synthetic 1C body chunk by chunk, like a fetch does.
+
+    Returns decode seconds, coercion seconds, their peak allocations and the
+    normalized frame; generating the synthetic text is not counted.
+    """
+    decode = coerce = 0.0
+    peaks = [0, 0]
+    frames = []
+    if memory:
+        tracemalloc.start()
+    for i, lo in enumerate(range(0, rows, CHUNK_ROWS)):
+        text = synth.raw_frame(min(CHUNK_ROWS, rows - lo), seed=i) \
+            .to_json(orient="records", force_ascii=False)
+        pieces = [text[j:j + PIECE] for j in range(0, len(text), PIECE)]
+        del text
+        for k, step in enumerate(("decode", "coerce")):
+            if memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            if step == "decode":
+                records = list(iter_records(pieces))
+                decode += time.perf_counter() - start
+            else:
+                frames.append(normalize(pd.DataFrame(records)))
+                del records
+                coerce += time.perf_counter() - start
+            if memory:
+                peaks[k] = max(peaks[k], tracemalloc.get_traced_memory()[1] - base)
+    start = time.perf_counter()
+    df = concat(frames)
+    coerce += time.perf_counter() - start
+    if memory:
+        tracemalloc.stop()
+    return decode, coerce, peaks[0], peaks[1], df
+
+
+def bench(rows: int, repeat: int, memory: bool) -> tuple[float, list[dict]]:
+    rec = Recorder(rows, repeat, memory)
+    decode, coerce, decode_peak, coerce_peak, df = ingest(rows, False)
+    if memory:
+        _, _, decode_peak, coerce_peak, _ = ingest(rows, True)
+    rec.add("json_decode", decode, decode_peak if memory else None)
+    rec.add("coerce", coerce, coerce_peak if memory else None)
+    bytes_per_row = df.memory_usage(deep=True).sum() / max(rows, 1)
+
+    cube = rec.run("cube_build", lambda: Cube(df))
+    index = rec.run("index_build", lambda: FilterIndex(df))
+    sketches = rec.run("sketch_build", lambda: Sketches(df, cube))
+
+    top_city = df["city_id"].value_counts().index[0]
+    top_tariff = df["provaider_tariff_name"].value_counts().index[0]
+    top_manager = df["manager_id"].value_counts().index[1]
+    cases = {
+        "all": {},
+        "city": {"city_id": top_city},
+        "city+tariff": {"city_id": top_city, "provaider_tariff_name": top_tariff},
+        "manager": {"manager_id": top_manager},
+    }
+    panels = {}
+    for name, filters in cases.items():
+        rows_ = rec.run(f"filter[{name}]", lambda: index.positions(filters))
+        rec.run(f"unique_subs[{name}]",
+                lambda: distinct(df["subscriber_id"], rows_))
+        rec.run(f"top10[{name}]", lambda: top_pairs(
+            df["subscriber_id"], df["subscriber_name"], rows_, 10))
+        panels[name] = rec.run(f"aggregate[{name}]",
+                               lambda: aggregate(df, cube, index, filters))
+        # "~": the approximate mode, distinct and top-10 from the sketches.
+        rec.run(f"aggregate~[{name}]", lambda: aggregate(
+            df, cube, index, filters, sketches=sketches))
+
+    until = df["connection_date"].max().date()
+    active = rec.run("activity[all]", lambda: activity(
+        df["subscriber_id"].cat.codes.to_numpy(),
+        df["connection_date"].to_numpy(),
+        df["disconnection_date"].to_numpy(), until))
+
+    # A first view builds and serializes each figure; a repeat view takes the
+    # finished one from the figure cache and only serializes it.
+    figures = SizedLRU("figures", charts.FIGURE_CACHE_BYTES)
+    for chart_id, build in {**charts.CHARTS, **charts.ACTIVITY_CHARTS}.items():
+        data = active if chart_id in charts.ACTIVITY_CHARTS else panels["all"]
+
+        def figure():
+            fig = build(data)
+            return fig.to_json() if fig is not None else None
+
+        def cached():
+            fig = figures.get(("all", chart_id), lambda: charts.render(
+                chart_id, data)).figure
+            return fig.to_json() if fig is not None else None
+        rec.run(f"figure[{chart_id}]", figure)
+        cached()
+        rec.run(f"figure_cached[{chart_id}]", cached)
+    return bytes_per_row, rec.results
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous(path: Path, rev: str) -> dict[tuple[int, str], dict]:
+    """Latest stored result per (rows, stage) from a different commit."""
+    out = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            r = json.loads(line)
+            if r["commit"] != rev:
+                out[(r["rows"], r["stage"])] = r
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the peak-allocation pass")
+    parser.add_argument("--out", type=Path, default=RESULTS)
+    parser.add_argument("--compare", action="store_true",
+                        help="exit 1 if a stage got slower than --threshold")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    rev = commit()
+    before = previous(args.out, rev)
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    regressions = 0
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with args.out.open("a") as out:
+        for rows in args.rows:
+            bytes_per_row, results = bench(rows, args.repeat, args.memory)
+            print(f"\n{rows:,} rows, {bytes_per_row:.1f} bytes/row in memory")
+            print(f"{'stage':<28}{'seconds':>12}{'peak MiB':>12}{'vs prev':>10}")
+            for r in results:
+                r.update(commit=rev, time=stamp, bytes_per_row=round(bytes_per_row, 1),
+                         python=sys.version.split()[0], pandas=pd.__version__)
+                out.write(json.dumps(r) + "\n")
+                old = before.get((rows, r["stage"]))
+                ratio = ""
+                if old and old["seconds"]:
+                    change = r["seconds"] / old["seconds"]
+                    ratio = f"{change:.2f}x"
+                    if change > args.threshold and r["seconds"] > 0.01:
+                        regressions += 1
+                        ratio += " !"
+                peak = "" if r["peak_mib"] is None else f"{r['peak_mib']:.1f}"
+                print(f"{r['stage']:<28}{r['seconds']:>12.4f}{peak:>12}{ratio:>10}")
+    if args.compare and regressions:
+        print(f"\n{regressions} stage(s) slower than {args.threshold}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from cube import DIMENSIONS
+
+
+class FilterIndex:
+    """Inverted index from each sidebar filter value to its rows.
+
+    Frequent values are kept as packed bitmaps (one bit per row), rare ones as
+    sorted row positions, whichever is smaller. A filter combination resolves
+    to row positions by intersecting them, without scanning any column.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: list[str] = DIMENSIONS):
+        self.rows = len(df)
+        self._bits: dict[tuple[str, str], np.ndarray] = {}
+        self._positions: dict[tuple[str, str], np.ndarray] = {}
+        dtype = np.int32 if self.rows < 2 ** 31 else np.int64
+        for column in columns:
+            codes = df[column].cat.codes.to_numpy()
+            order = np.argsort(codes, kind="stable").astype(dtype)
+            bounds = np.searchsorted(codes[order], np.arange(
+                len(df[column].cat.categories) + 1))
+            for k, value in enumerate(df[column].cat.categories):
+                positions = order[bounds[k]:bounds[k + 1]]
+                if not len(positions):
+                    continue
+                if len(positions) * positions.itemsize * 8 > self.rows:
+                    mask = np.zeros(self.rows, dtype=bool)
+                    mask[positions] = True
+                    self._bits[(column, value)] = np.packbits(mask)
+                else:
+                    self._positions[(column, value)] = positions
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self._bits.values()) + \
+            sum(a.nbytes for a in self._positions.values())
+
+    def positions(self, filters: dict) -> np.ndarray | None:
+        """Sorted row positions matching every {column: value}; None for all."""
+        if not filters:
+            return None
+        keys = list(filters.items())
+        bits = [self._bits[k] for k in keys if k in self._bits]
+        sparse = sorted((self._positions[k] for k in keys
+                         if k in self._positions), key=len)
+        if len(bits) + len(sparse) < len(keys):
+            return np.empty(0, dtype=np.int64)
+
+        bits = reduce(np.bitwise_and, bits) if bits else None
+        if not sparse:
+            return np.flatnonzero(np.unpackbits(bits, count=self.rows))
+        out = sparse[0]
+        for other in sparse[1:]:
+            out = np.intersect1d(out, other, assume_unique=True)
+        if bits is not None:
+            out = out[(bits[out >> 3] >> (7 - (out & 7))) & 1 == 1]
+        return out
+
+
+def take_codes(column: pd.Series, positions: np.ndarray | None) -> np.ndarray:
+    """Category codes of a column at the given rows, without copying the frame."""
+    codes = column.cat.codes.to_numpy()
+    return codes if positions is None else codes[positions]
+
+
+def distinct(column: pd.Series, positions: np.ndarray | None) -> int:
+    """Number of distinct non-null values at the given rows."""
+    codes = take_codes(column, positions)
+    return int(np.count_nonzero(np.bincount(codes[codes >= 0])))
+
+
+def top_pairs(a: pd.Series, b: pd.Series, positions: np.ndarray | None,
+              n: int) -> pd.DataFrame:
+    """The n most frequent (a, b) pairs at the given rows, with their counts."""
+    ca, cb = take_codes(a, positions), take_codes(b, positions)
+    keep = (ca >= 0) & (cb >= 0)
+    width = len(b.cat.categories)
+    keys, counts = np.unique(ca[keep].astype(np.int64) * width + cb[keep],
+                             return_counts=True)
+    best = np.argsort(-counts, kind="stable")[:n]
+    return pd.DataFrame({
+        a.name: a.cat.categories[keys[best] // width],
+        b.name: b.cat.categories[keys[best] % width],
+        "count": counts[best],
+    })
@@ -0,0 +1,132 @@
+"""Byte-budgeted LRU caches of assembled ranges, query backends and figures.
+
+Each value's footprint is measured when it is stored and again on every hit,
+since backends grow as they build sort orders and sketches on demand. The
+least recently used entries are evicted while the cache is over its budget; a
+value larger than the whole budget is returned but not kept. A frame held by
+two caches is charged to both, so the budgets bound memory from above.
+
+Hits, misses, evictions and resident bytes of every cache are exported with
+the stage metrics and shown in the debug panel.
+"""
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+import numpy as np
+import pandas as pd
+
+from metrics import collect
+
+_caches: "weakref.WeakSet[SizedLRU]" = weakref.WeakSet()
+
+
+def footprint(value) -> int:
+    """Bytes held by a cached value: frames deep, objects by their nbytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(footprint(v) for v in value)
+    if isinstance(value, np.ndarray) or hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class SizedLRU:
+    def __init__(self, name: str, budget: int):
+        self.name, self.budget = name, budget
+        self.hits = self.misses = self.evictions = 0
+        self.resident = 0
+        self._entries: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+        self._building: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _hit(self, key: Hashable):
+        value, size = self._entries[key]
+        self._entries.move_to_end(key)
+        self.hits += 1
+        now = footprint(value)
+        if now != size:
+            self._entries[key] = (value, now)
+            self.resident += now - size
+            self._evict()
+        return value
+
+    def get(self, key: Hashable, build: Callable[[], object]):
+        """The cached value of key, built and stored on a miss.
+
+        Concurrent misses of one key build it once; the others wait for it.
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._hit(key)
+            self.misses += 1
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key][0]
+            try:
+                value = build()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return value
+
+    def put(self, key: Hashable, value):
+        size = footprint(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.resident -= old[1]
+            if size > self.budget:
+                return
+            self._entries[key] = (value, size)
+            self.resident += size
+            self._evict()
+
+    def _evict(self):
+        while self.resident > self.budget and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.resident -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cache": self.name, "entries": len(self._entries),
+                    "resident_bytes": self.resident, "budget_bytes": self.budget,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+def stats() -> list[dict]:
+    """Counters of every live cache, by name."""
+    return sorted((c.stats() for c in list(_caches)), key=lambda s: s["cache"])
+
+
+@collect
+def _prometheus() -> list[str]:
+    lines = []
+    for metric, kind, field, text in [
+        ("bi_cache_hits_total", "counter", "hits", "Cache lookups served."),
+        ("bi_cache_misses_total", "counter", "misses", "Cache lookups built."),
+        ("bi_cache_evictions_total", "counter", "evictions",
+         "Entries evicted over budget."),
+        ("bi_cache_resident_bytes", "gauge", "resident_bytes",
+         "Measured bytes of the cached entries."),
+        ("bi_cache_budget_bytes", "gauge", "budget_bytes", "Byte budget."),
+        ("bi_cache_entries", "gauge", "entries", "Cached entries."),
+    ]:
+        lines += [f"# HELP {metric} {text}", f"# TYPE {metric} {kind}"]
+        for s in stats():
+            lines.append(f'{metric}{{cache="{s["cache"]}"}} {s[field]}')
+    return lines
@@ -0,0 +1,290 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from churn import Activity
+from panels import Panels
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Ivory / cream palette
+# ─────────────────────────────────────────────────────────────────────────────
+BG       = "#FFFDF7"
+BG_SIDE  = "#F5F0E8"
+CARD     = "#FFFFFF"
+BORDER   = "rgba(0,0,0,0.06)"
+TEXT     = "#2d2a26"
+TEXT_SEC = "#8a8378"
+ACCENT1  = "#6c5ce7"
+ACCENT2  = "#00b894"
+ACCENT3  = "#e17055"
+ACCENT4  = "#0984e3"
+
+PALETTE = [ACCENT1, ACCENT2, ACCENT3, ACCENT4,
+           "#fdcb6e", "#e84393", "#74b9ff", "#55efc4",
+           "#a29bfe", "#fab1a0"]
+
+PLOTLY_LAYOUT = dict(
+    plot_bgcolor="rgba(0,0,0,0)",
+    paper_bgcolor="rgba(0,0,0,0)",
+    font=dict(family="Inter, SF Pro Display, -apple-system, sans-serif",
+              size=13, color=TEXT_SEC),
+    title_font=dict(family="Inter, SF Pro Display, -apple-system, sans-serif",
+                    size=17, color=TEXT),
+    coloraxis_showscale=False,
+    margin=dict(t=52, b=36, l=16, r=16),
+    xaxis=dict(showgrid=True, gridcolor="rgba(0,0,0,0.04)",
+               zeroline=False, title_font_color=TEXT_SEC),
+    yaxis=dict(showgrid=True, gridcolor="rgba(0,0,0,0.04)",
+               zeroline=False, title_font_color=TEXT_SEC),
+)
+
+DAY_LABELS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+# A time series longer than SERIES_POINTS is downsampled to that many points;
+# one drawing more than GL_POINTS is rendered with WebGL, without markers.
+SERIES_POINTS = 1500
+GL_POINTS = 400
+
+# Byte budget of finished figures kept for repeat views, by serialized size.
+FIGURE_CACHE_BYTES = int(os.environ.get("BI_FIGURE_CACHE_MB", "64")) << 20
+
+
+def styled(fig, **kw):
+    fig.update_layout(**{**PLOTLY_LAYOUT, **kw})
+    return fig
+
+
+def nonblank(counts: pd.Series) -> pd.Series:
+    return counts[counts.index.astype(str).str.strip() != ""]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Positions of n points that keep the visual shape of (x, y).
+
+    Largest-Triangle-Three-Buckets: the first and last points are kept, the
+    rest are split into n - 2 buckets and from each the point forming the
+    largest triangle with the previously kept point and the next bucket's
+    mean is taken, which preserves peaks and dips.
+    """
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.append(np.linspace(1, size - 1, n - 1).astype(np.int64), size)
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi, nhi = edges[i], edges[i + 1], edges[i + 2]
+        avg_x, avg_y = x[hi:nhi].mean(), y[hi:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Figures, one per dashboard chart
+# ─────────────────────────────────────────────────────────────────────────────
+def monthly(p: Panels) -> go.Figure:
+    monthly = p.monthly.reset_index()
+    fig = px.bar(monthly, x="month", y="count", text="count",
+                 color_discrete_sequence=[ACCENT1])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, title_text="Подписки по месяцам",
+                  xaxis_title="", yaxis_title="")
+
+
+def tariffs(p: Panels) -> go.Figure:
+    tc = p.tariffs.reset_index()
+    tc.columns = ["tariff", "count"]
+    fig = px.pie(tc, names="tariff", values="count", hole=0.55,
+                 color_discrete_sequence=PALETTE)
+    fig.update_traces(textposition="inside", textinfo="percent+label",
+                      textfont_size=12)
+    return styled(fig, title_text="По тарифам", showlegend=False)
+
+
+def cities(p: Panels) -> go.Figure:
+    cc = nonblank(p.cities).reset_index()
+    cc.columns = ["city", "count"]
+    fig = px.bar(cc.head(15), x="count", y="city", orientation="h",
+                 text="count", color_discrete_sequence=[ACCENT2])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, title_text="По городам",
+                  yaxis=dict(autorange="reversed", showgrid=False),
+                  xaxis_title="", yaxis_title="")
+
+
+def types(p: Panels) -> go.Figure:
+    tyc = p.types.reset_index()
+    tyc.columns = ["type", "count"]
+    fig = px.pie(tyc, names="type", values="count", hole=0.55,
+                 color_discrete_sequence=[ACCENT2, ACCENT3, ACCENT1, ACCENT4])
+    fig.update_traces(textposition="inside", textinfo="percent+label",
+                      textfont_size=12)
+    return styled(fig, title_text="Тип подписки", showlegend=False)
+
+
+def timeline(series: pd.Series, title: str, color: str = ACCENT1,
+             fill: str = "rgba(108,92,231,0.07)") -> go.Figure:
+    """A filled time series, downsampled and drawn with WebGL when long."""
+    points = series.reset_index()
+    points.columns = ["date", "count"]
+    if len(points) > SERIES_POINTS:
+        x = pd.to_datetime(points["date"]).to_numpy().view(np.int64)
+        points = points.iloc[lttb(x, points["count"].to_numpy(), SERIES_POINTS)]
+    fig = go.Figure()
+    if len(points) > GL_POINTS:
+        fig.add_trace(go.Scattergl(
+            x=points["date"], y=points["count"],
+            mode="lines", fill="tozeroy",
+            line=dict(color=color, width=1.5),
+            fillcolor=fill,
+        ))
+    else:
+        fig.add_trace(go.Scatter(
+            x=points["date"], y=points["count"],
+            mode="lines+markers", fill="tozeroy",
+            line=dict(color=color, width=2.5, shape="spline"),
+            marker=dict(size=5, color=color),
+            fillcolor=fill,
+        ))
+    return styled(fig, title_text=title, xaxis_title="", yaxis_title="")
+
+
+def daily(p: Panels) -> go.Figure:
+    return timeline(p.daily, "Динамика подключений")
+
+
+def amount(p: Panels) -> go.Figure:
+    if p.total_amount > 0:
+        ma = p.amount_monthly.reset_index()
+        fig = px.bar(ma, x="month", y="amount", text="amount",
+                     color_discrete_sequence=[ACCENT3])
+        fig.update_traces(textposition="outside", texttemplate="%{text:,.0f}",
+                          marker_line_width=0, marker_cornerradius=8)
+        return styled(fig, title_text="Сумма по месяцам",
+                      xaxis_title="", yaxis_title="")
+    bc = p.billing.reset_index()
+    bc.columns = ["period", "count"]
+    fig = px.bar(bc, x="period", y="count", text="count",
+                 color_discrete_sequence=[ACCENT3])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, title_text="Период биллинга",
+                  xaxis_title="", yaxis_title="", showlegend=False)
+
+
+def managers(p: Panels) -> go.Figure | None:
+    """None when no subscription in the selection has a manager."""
+    mc = nonblank(p.managers).reset_index()
+    if mc.empty:
+        return None
+    mc.columns = ["manager", "count"]
+    fig = px.bar(mc.head(10), x="count", y="manager", orientation="h",
+                 text="count", color_discrete_sequence=[ACCENT4])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, title_text="По менеджерам",
+                  yaxis=dict(autorange="reversed", showgrid=False),
+                  xaxis_title="", yaxis_title="")
+
+
+def bonus(p: Panels) -> go.Figure:
+    bd = p.bonus[p.bonus.index > 0].reset_index()
+    if not bd.empty:
+        bd.columns = ["pct", "count"]
+        fig = px.bar(bd, x="pct", y="count", text="count",
+                     color_discrete_sequence=[ACCENT4])
+        fig.update_traces(textposition="outside", marker_line_width=0,
+                          marker_cornerradius=8)
+        return styled(fig, title_text="Бонусы (%)", xaxis_title="", yaxis_title="")
+    dow = p.weekdays.reset_index()
+    dow.columns = ["day", "count"]
+    dow["label"] = DAY_LABELS
+    fig = px.bar(dow, x="label", y="count", text="count",
+                 color_discrete_sequence=[ACCENT1])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, title_text="По дням недели",
+                  xaxis_title="", yaxis_title="", showlegend=False)
+
+
+def top(p: Panels) -> go.Figure:
+    top = p.top.rename(columns={"count": "subs"})
+    fig = px.bar(top, x="subs", y="subscriber_name", orientation="h",
+                 text="subs", color_discrete_sequence=[ACCENT1])
+    fig.update_traces(textposition="outside", marker_line_width=0,
+                      marker_cornerradius=8)
+    return styled(fig, yaxis=dict(autorange="reversed", showgrid=False),
+                  xaxis_title="", yaxis_title="", height=400)
+
+
+def active(a: Activity) -> go.Figure:
+    return timeline(a.active, "Активные абоненты из подключённых в периоде",
+                    ACCENT2, "rgba(0,184,148,0.07)")
+
+
+def churn(a: Activity) -> go.Figure:
+    m = a.monthly.reset_index()
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=m["month"], y=m["churned"], text=m["churned"],
+                         name="Ушли", marker_color=ACCENT3,
+                         marker_line_width=0, marker_cornerradius=8,
+                         textposition="outside"))
+    fig.add_trace(go.Scatter(x=m["month"], y=m["rate"] * 100, name="Отток, %",
+                             yaxis="y2", mode="lines+markers",
+                             line=dict(color=ACCENT1, width=2.5),
+                             marker=dict(size=6, color=ACCENT1),
+                             hovertemplate="%{y:.1f}%<extra></extra>"))
+    return styled(fig, title_text="Отток подключённых в периоде",
+                  xaxis_title="", yaxis_title="",
+                  yaxis2=dict(overlaying="y", side="right", showgrid=False,
+                              ticksuffix="%", rangemode="tozero"),
+                  legend=dict(orientation="h", y=1.08, x=1, xanchor="right"))
+
+
+# Shown instead of a chart whose builder returned None.
+EMPTY_TEXT = {"managers": "Нет данных по менеджерам"}
+
+CHARTS = {
+    "monthly": monthly,
+    "tariffs": tariffs,
+    "cities": cities,
+    "types": types,
+    "daily": daily,
+    "amount": amount,
+    "managers": managers,
+    "bonus": bonus,
+    "top": top,
+}
+
+# Built from the selection's Activity rather than its Panels.
+ACTIVITY_CHARTS = {
+    "active": active,
+    "churn": churn,
+}
+
+
+@dataclass(frozen=True)
+class Rendered:
+    """A finished chart, None when there is nothing to draw, and the size of
+    its serialized spec."""
+    figure: go.Figure | None
+    nbytes: int
+
+
+def render(chart_id: str, data: Panels | Activity) -> Rendered:
+    """The chart_id chart of data, validated once, ready to be served again."""
+    build = ACTIVITY_CHARTS.get(chart_id) or CHARTS[chart_id]
+    fig = build(data)
+    return Rendered(fig, 0 if fig is None else len(fig.to_json()))
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Stands in for "still connected" (no disconnection date), in epoch days.
+OPEN = 1 << 30
+
+
+@dataclass(frozen=True)
+class Activity:
+    """Active subscriber base and churn of one filter selection.
+
+    A subscriber is active on a day when any of their subscriptions is: from
+    its connection date up to, not including, its disconnection date.
+    Overlapping or back-to-back subscriptions of one subscriber form a single
+    active spell; the subscriber churns on the day a spell ends.
+
+    Only the subscriptions passed in are seen, and the backends pass those
+    connected within the loaded period. Subscribers connected before it and
+    still active are missing, so the base starts at zero on the period's
+    first day and churn rates are relative to the period's own connections.
+    """
+    active: pd.Series    # subscribers active per day
+    monthly: pd.DataFrame  # per month: active at start, new, churned, rate
+
+
+def activity(subscribers: np.ndarray, connected: np.ndarray,
+             disconnected: np.ndarray, until: date) -> Activity:
+    """Sweep the subscription intervals into daily and monthly series.
+
+    subscribers holds integer codes (-1 for missing), the dates are
+    datetime64 arrays (NaT disconnection for a subscription still active).
+    Spells are merged after one sort by (subscriber, connection), then the
+    daily base is a prefix sum over +1/-1 events at spell bounds: O(n log n)
+    in subscriptions, O(days) in the period, never their product.
+    """
+    start = connected.astype("datetime64[D]").view(np.int64)
+    end = disconnected.astype("datetime64[D]").view(np.int64)
+    keep = (subscribers >= 0) & ~np.isnat(connected)
+    sub, start = subscribers[keep].astype(np.int64), start[keep]
+    end = np.where(np.isnat(disconnected[keep]), OPEN,
+                   np.maximum(end[keep], start))
+    last = np.datetime64(until, "D").view(np.int64)
+    if not len(start) or start.min() > last:
+        return _empty()
+
+    order = np.lexsort((start, sub))
+    sub, start, end = sub[order], start[order], end[order]
+    # Running latest end within each subscriber: offsetting every subscriber
+    # by more than the span of days lets one accumulate serve all of them.
+    offset = sub * (2 * OPEN)
+    reach = np.maximum.accumulate(end + offset) - offset
+    first_of = np.ones(len(sub), dtype=bool)
+    first_of[1:] = (sub[1:] != sub[:-1]) | (start[1:] > reach[:-1])
+    begins = np.flatnonzero(first_of)
+    spell_start = start[begins]
+    spell_end = reach[np.append(begins[1:], len(sub)) - 1]
+
+    first = spell_start.min()
+    n = last - first + 1
+    opened = np.bincount(spell_start[spell_start <= last] - first, minlength=n)
+    closed = np.bincount(spell_end[spell_end <= last] - first, minlength=n)
+    days = pd.date_range(pd.Timestamp(first, unit="D"), periods=n, freq="D",
+                         name="day")
+    change = opened - closed
+    base = np.cumsum(change)
+    active = pd.Series(base, index=days, name="active")
+
+    # The base a month starts from is the one left by the day before it.
+    by_month = pd.DataFrame({"active": base - change, "new": opened,
+                             "churned": closed}, index=days) \
+        .groupby(days.to_period("M"))
+    monthly = by_month.agg({"active": "first", "new": "sum", "churned": "sum"})
+    monthly["rate"] = monthly["churned"] / monthly["active"].where(
+        monthly["active"] > 0)
+    monthly.index = monthly.index.astype(str).rename("month")
+    return Activity(active=active, monthly=monthly)
+
+
+def _empty() -> Activity:
+    return Activity(
+        active=pd.Series([], dtype=np.int64, name="active",
+                         index=pd.DatetimeIndex([], name="day")),
+        monthly=pd.DataFrame({"active": [], "new": [], "churned": [],
+                              "rate": []}, index=pd.Index([], name="month")),
+    )
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# Sidebar filter columns, in sidebar order.
+DIMENSIONS = ["city_id", "provaider_tariff_name", "subscription_type",
+              "manager_id", "billing_period"]
+
+
+class Cube:
+    """Subscription counts and sums pre-aggregated per day and filter values.
+
+    Cells are keyed by connection day, the five filter dimensions and the
+    bonus percent, so every chart that only needs counts or sums can be rolled
+    up from a slice of the cube instead of rescanning the raw rows. Each key
+    is held as integer codes into `labels`, -1 standing for a missing value.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        keys = ["day", *DIMENSIONS, "procent_bonus_id"]
+        grouped = (df[[*DIMENSIONS, "procent_bonus_id", "amount"]]
+                   .assign(day=df["connection_date"].dt.normalize())
+                   .groupby(keys, observed=True, dropna=False, sort=False))
+        cells = (grouped.agg(count=("amount", "size"), amount=("amount", "sum"))
+                 .reset_index())
+        self.size = len(cells)
+        # The cell of every row of df, for per-cell summaries built later.
+        self.cell = grouped.ngroup().to_numpy(dtype=np.int32)
+        self.count = cells["count"].to_numpy()
+        self.amount = cells["amount"].to_numpy(dtype=float)
+        self.bonus = cells["procent_bonus_id"].to_numpy(dtype=float) * self.count
+
+        self.codes: dict[str, np.ndarray] = {}
+        self.labels: dict[str, pd.Index] = {}
+        for column in DIMENSIONS:
+            self.codes[column] = cells[column].cat.codes.to_numpy()
+            self.labels[column] = cells[column].cat.categories
+        for column in ("day", "procent_bonus_id"):
+            codes, labels = pd.factorize(cells[column], sort=True)
+            self.codes[column], self.labels[column] = codes, pd.Index(labels)
+
+        days = self.labels["day"]
+        months, self.labels["month"] = pd.factorize(days.to_period("M"), sort=True)
+        self.labels["month"] = self.labels["month"].astype(str)
+        self.codes["month"] = _remap(self.codes["day"], months)
+        self.codes["weekday"] = _remap(self.codes["day"], days.dayofweek)
+        self.labels["weekday"] = pd.RangeIndex(7)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.count, self.amount, self.bonus,
+                                      self.cell, *self.codes.values()))
+
+    def select(self, filters: dict) -> np.ndarray | None:
+        """Positions of the cells matching every {dimension: value}."""
+        if not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        for column, value in filters.items():
+            labels = self.labels[column]
+            if value not in labels:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.codes[column] == labels.get_loc(value)
+        return np.flatnonzero(mask)
+
+    def options(self, column: str) -> list:
+        """Values of a dimension that occur in the data, sorted."""
+        present = np.unique(self.codes[column])
+        return self.labels[column][present[present >= 0]].tolist()
+
+
+def _remap(codes: np.ndarray, table) -> np.ndarray:
+    """Map codes through a lookup table, keeping -1 for missing."""
+    return np.append(np.asarray(table, dtype=np.int64), -1)[codes]
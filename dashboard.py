@@ -1,9 +1,29 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import requests
-from datetime import date
+import time
+from dataclasses import replace
+from functools import wraps
+from datetime import date, datetime
+from pathlib import Path
+
+import cache
+import charts
+import metrics
+import snapshot
+from backend import (BACKEND, BACKEND_CACHE_BYTES, Backend, DuckDBBackend,
+                     PandasBackend, Query)
+from cache import SizedLRU
+from churn import Activity
+from cube import DIMENSIONS
+from data import PartitionCache
+from export import FORMATS, export
+from panels import Panels, Snapshot, filter_key
+from charts import (ACCENT1, ACCENT2, ACCENT3, ACCENT4, BG, BG_SIDE, BORDER,
+                    CARD, TEXT, TEXT_SEC)
+from refresh import Refresher
+from sketch import HH_COUNTERS, hll_error
+from snapshot import DEFAULT_FROM
+from store import PartitionStore
 
 st.set_page_config(
     page_title="BI Subscriptions",
@@ -12,38 +32,7 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Ivory / cream palette
-# ─────────────────────────────────────────────────────────────────────────────
-BG       = "#FFFDF7"
-BG_SIDE  = "#F5F0E8"
-CARD     = "#FFFFFF"
-BORDER   = "rgba(0,0,0,0.06)"
-TEXT     = "#2d2a26"
-TEXT_SEC = "#8a8378"
-ACCENT1  = "#6c5ce7"
-ACCENT2  = "#00b894"
-ACCENT3  = "#e17055"
-ACCENT4  = "#0984e3"
-
-PALETTE = [ACCENT1, ACCENT2, ACCENT3, ACCENT4,
-           "#fdcb6e", "#e84393", "#74b9ff", "#55efc4",
-           "#a29bfe", "#fab1a0"]
-
-PLOTLY_LAYOUT = dict(
-    plot_bgcolor="rgba(0,0,0,0)",
-    paper_bgcolor="rgba(0,0,0,0)",
-    font=dict(family="Inter, SF Pro Display, -apple-system, sans-serif",
-              size=13, color=TEXT_SEC),
-    title_font=dict(family="Inter, SF Pro Display, -apple-system, sans-serif",
-                    size=17, color=TEXT),
-    coloraxis_showscale=False,
-    margin=dict(t=52, b=36, l=16, r=16),
-    xaxis=dict(showgrid=True, gridcolor="rgba(0,0,0,0.04)",
-               zeroline=False, title_font_color=TEXT_SEC),
-    yaxis=dict(showgrid=True, gridcolor="rgba(0,0,0,0.04)",
-               zeroline=False, title_font_color=TEXT_SEC),
-)
+run = metrics.begin(trace_memory=st.session_state.get("debug", False))
 
 st.markdown(f"""
 <style>
@@ -258,28 +247,94 @@ h3 {{
 # ─────────────────────────────────────────────────────────────────────────────
 # Data
 # ─────────────────────────────────────────────────────────────────────────────
-@st.cache_data(ttl=300)
-def load_data(date_from: str, date_to: str) -> pd.DataFrame:
-    url = "https://1c-lk.uztelecom.uz/a/adm/hs/BI/subscriptions"
-    resp = requests.get(
-        url, params={"from": date_from, "to": date_to},
-        auth=("BI", "Syxukogepe96"), verify=False,
-    )
-    resp.encoding = "utf-8"
-    df = pd.DataFrame(resp.json())
-    for c in ["subscription_conection_time", "connection_date", "disconnection_date"]:
-        df[c] = pd.to_datetime(df[c], errors="coerce")
-    for c in ["quantity", "amount", "procent_bonus_id", "amount_of_remuneration_id"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
-    df["subscriber_id"] = df["subscriber_id"].astype(str)
-    df["month"] = df["connection_date"].dt.to_period("M").astype(str)
-    df["day_of_week"] = df["connection_date"].dt.day_name()
-    return df
+@st.cache_resource
+def partition_store() -> PartitionStore:
+    return PartitionStore()
+
+
+@st.cache_resource
+def partition_cache() -> PartitionCache:
+    return PartitionCache(store=partition_store())
+
+
+@st.cache_resource
+def refresher() -> Refresher:
+    return Refresher(partition_cache(), warm=warm).start()
+
+
+def load_data(date_from: date, date_to: date) -> tuple[str, pd.DataFrame | None]:
+    """(version, frame) of the range; no frame when the backend reads the store.
+
+    Expired days are served as held; touching the range has the refresher
+    refetch them.
+    """
+    with metrics.stage("load"):
+        if BACKEND == "duckdb":
+            return partition_cache().version(date_from, date_to, wait=False), None
+        return partition_cache().load(date_from, date_to, wait=False)
+
+
+@st.cache_resource
+def backends() -> SizedLRU:
+    return SizedLRU("backends", BACKEND_CACHE_BYTES)
+
+
+def build_backend(version: str, date_from: date, date_to: date,
+                  df: pd.DataFrame | None) -> Backend:
+    if df is None:
+        return backends().get(version, lambda: DuckDBBackend(
+            version, partition_store(), date_from, date_to))
+    return backends().get(version, lambda: PandasBackend(version, df))
+
+
+def warm(date_from: date, date_to: date):
+    """Build a refreshed range's backend before its next view needs it."""
+    version, df = load_data(date_from, date_to)
+    build_backend(version, date_from, date_to, df)
+
+
+def live(date_from: date, date_to: date) -> Backend:
+    """The range's backend, loading the range if it is not held yet."""
+    refresher().touch(date_from, date_to)
+    with st.spinner(""):
+        version, df = load_data(date_from, date_to)
+        return build_backend(version, date_from, date_to, df)
+
+
+@st.cache_resource(max_entries=2)
+def read_snapshot(path: str) -> Snapshot | None:
+    return snapshot.read(Path(path))
+
+
+def latest_snapshot() -> Snapshot | None:
+    path = snapshot.latest_path()
+    return read_snapshot(str(path)) if path is not None else None
+
 
+@st.cache_resource(max_entries=64)
+def compute_panels(version: str, key: tuple, approximate: bool,
+                   _backend: Backend) -> Panels:
+    filters = {col: sel for col, sel in zip(DIMENSIONS, key) if sel is not None}
+    return _backend.panels(filters, approximate)
 
-def styled(fig, **kw):
-    fig.update_layout(**{**PLOTLY_LAYOUT, **kw})
-    return fig
+
+@st.cache_resource(max_entries=16)
+def compute_hourly(version: str, key: tuple, _backend: Backend) -> pd.Series:
+    filters = {col: sel for col, sel in zip(DIMENSIONS, key) if sel is not None}
+    return _backend.hourly(filters)
+
+
+@st.cache_resource(max_entries=16)
+def compute_activity(version: str, key: tuple, until: date,
+                     _backend: Backend) -> Activity:
+    filters = {col: sel for col, sel in zip(DIMENSIONS, key) if sel is not None}
+    with metrics.stage("activity"):
+        return _backend.activity(filters, until)
+
+
+@st.cache_resource
+def figures() -> SizedLRU:
+    return SizedLRU("figures", charts.FIGURE_CACHE_BYTES)
 
 
 ALL = "Все"
@@ -293,81 +348,230 @@ with st.sidebar:
 
     st.markdown('<div class="sidebar-section">Период</div>',
                 unsafe_allow_html=True)
-    d_from = st.date_input("С", value=date(2025, 4, 25))
+    d_from = st.date_input("С", value=DEFAULT_FROM)
     d_to   = st.date_input("По", value=date.today())
 
     if st.button("Обновить", use_container_width=True):
-        st.cache_data.clear()
+        partition_cache().refresh(d_from, d_to, lead=0)
+        # Fresher than any snapshot from now on.
+        st.session_state["live"] = True
 
     st.markdown("---")
     st.markdown('<div class="sidebar-section">Фильтры</div>',
                 unsafe_allow_html=True)
 
-with st.spinner(""):
-    df = load_data(f"{d_from}T00:00:00", f"{d_to}T23:59:59")
+# The latest snapshot, when it is of this period, renders the precomputed
+# selections without loading anything; the rest load the range on demand.
+snap = latest_snapshot()
+if st.session_state.get("live") or snap is None or not snap.covers(d_from, d_to):
+    snap = None
+backend = live(d_from, d_to) if snap is None else None
+rows = snap.rows if snap is not None else backend.rows
 
-if df.empty:
+if not rows:
     st.warning("Нет данных за выбранный период.")
+    metrics.finish(run, rows=0)
     st.stop()
 
-with st.sidebar:
-    cities = sorted([c for c in df["city_id"].dropna().unique() if str(c).strip()])
-    sel_city = st.selectbox("Город", [ALL] + cities)
+# ─────────────────────────────────────────────────────────────────────────────
+# Fragments
+# ─────────────────────────────────────────────────────────────────────────────
+def fragment(name: str):
+    """st.fragment, timed.
+
+    A widget inside a fragment reruns only the fragment, with the arguments of
+    its last call; the CSS, the load and everything outside are not executed
+    again. Inside a full run the fragment is a stage, fragment[name]; rerun
+    alone it is a run of its own, rerun[name].
+    """
+    def decorate(fn):
+        @st.fragment
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if metrics.current() is not None:
+                with metrics.stage(f"fragment[{name}]"):
+                    return fn(*args, **kwargs)
+            own = metrics.begin(trace_memory=st.session_state.get("debug", False))
+            try:
+                with metrics.stage(f"fragment[{name}]"):
+                    return fn(*args, **kwargs)
+            finally:
+                metrics.finish(own, name=f"rerun[{name}]")
+                remember(own, f"rerun[{name}]")
+        return timed
+    return decorate
+
+
+def remember(run: metrics.Run, name: str):
+    """Keep the session's latest run, fragment reruns included, for the
+    debug panel."""
+    st.session_state["last_run"] = (name, time.time() - run.started,
+                                    run.summary())
+
+
+def chart(chart_id: str, data: Panels | Activity, state: tuple):
+    """A chart from the selection's Panels, or its Activity for ACTIVITY_CHARTS.
+
+    The finished figure is cached by state, the data version and filters data
+    was computed for, so a repeat view of the selection builds nothing.
+    """
+    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
 
-    tariffs = sorted(df["provaider_tariff_name"].dropna().unique().tolist())
-    sel_tariff = st.selectbox("Тариф", [ALL] + tariffs)
+    def build():
+        with metrics.stage(f"figure[{chart_id}]"):
+            return charts.render(chart_id, data)
 
-    sub_types = sorted(df["subscription_type"].dropna().unique().tolist())
-    sel_type = st.selectbox("Тип подписки", [ALL] + sub_types)
+    with metrics.stage(f"chart[{chart_id}]"):
+        fig = figures().get((*state, chart_id), build).figure
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True)
+    if fig is None:
+        st.markdown(f'<div style="padding:48px;text-align:center;'
+                    f'color:{TEXT_SEC};font-size:0.92rem">'
+                    f'{charts.EMPTY_TEXT[chart_id]}</div>',
+                    unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
 
-    managers = sorted([m for m in df["manager_id"].dropna().unique() if str(m).strip()])
-    sel_manager = st.selectbox("Менеджер", [ALL] + managers) if managers else ALL
 
-    billing_periods = sorted(df["billing_period"].dropna().unique().tolist())
-    sel_billing = st.selectbox("Биллинг", [ALL] + billing_periods)
+@fragment("daily")
+def daily_chart(backend: Backend | None, d_from: date, d_to: date, key: tuple,
+                p: Panels, state: tuple):
+    if st.radio("Шаг", ["День", "Час"], horizontal=True,
+                label_visibility="collapsed") == "Час":
+        backend = backend or live(d_from, d_to)
+        p = replace(p, daily=compute_hourly(backend.version, key, backend))
+        state = (backend.version, key, "hour")
+    chart("daily", p, state)
+
+
+@fragment("export")
+def download(backend: Backend, query: Query, total: int, name: str):
+    c_fmt, c_dl = st.columns([2, 3])
+    fmt = c_fmt.radio("Формат", list(FORMATS), horizontal=True,
+                      format_func=str.upper, label_visibility="collapsed")
+    c_dl.download_button(
+        f"Скачать {total:,} строк",
+        data=lambda: export(backend.chunks(query), backend.columns, fmt),
+        file_name=f"{name}.{fmt}",
+        mime=FORMATS[fmt][0],
+        on_click="ignore",
+    )
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Apply filters
-# ─────────────────────────────────────────────────────────────────────────────
-mask = pd.Series(True, index=df.index)
-if sel_city != ALL:
-    mask &= df["city_id"] == sel_city
-if sel_tariff != ALL:
-    mask &= df["provaider_tariff_name"] == sel_tariff
-if sel_type != ALL:
-    mask &= df["subscription_type"] == sel_type
-if sel_manager != ALL:
-    mask &= df["manager_id"] == sel_manager
-if sel_billing != ALL:
-    mask &= df["billing_period"] == sel_billing
-
-filtered = df[mask].copy()
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Header
-# ─────────────────────────────────────────────────────────────────────────────
-st.markdown("# Subscriptions")
-st.markdown(
-    f'<p class="subtitle">{d_from.strftime("%d.%m.%Y")} &mdash; '
-    f'{d_to.strftime("%d.%m.%Y")}'
-    f'&nbsp;&nbsp;&middot;&nbsp;&nbsp;'
-    f'{len(filtered)} из {len(df)} записей</p>',
-    unsafe_allow_html=True,
-)
+@fragment("table")
+def table(backend: Backend | None, d_from: date, d_to: date, filters: dict):
+    """The selection's rows and their export.
+
+    A page served from the snapshot has no backend; the range is loaded,
+    within this fragment, only once the rows are asked for.
+    """
+    if backend is None:
+        if not st.toggle("Показать строки",
+                         help="Загрузит весь период из источника"):
+            return
+        backend = live(d_from, d_to)
+    c_sort, c_desc, c_col, c_text, c_size = st.columns([3, 1.2, 3, 3, 1.5])
+    NONE = "—"
+    sort_by = c_sort.selectbox("Сортировка", [NONE] + backend.columns)
+    descending = c_desc.toggle("По убыв.", disabled=sort_by == NONE)
+    search_col = c_col.selectbox("Поиск по столбцу", backend.columns,
+                                 index=backend.columns.index("subscriber_name"))
+    search_text = c_text.text_input("Содержит", placeholder="текст")
+    page_size = c_size.selectbox("Строк", [50, 100, 500, 1000])
+
+    query = Query(filters, None if sort_by == NONE else sort_by, descending,
+                  search_col, search_text.strip())
+    with metrics.stage("table"):
+        total = backend.count(query)
+        pages = max(-(-total // page_size), 1)
+        page_no = st.number_input(f"Страница (из {pages:,})", min_value=1,
+                                  max_value=pages, value=1) - 1
+        st.dataframe(backend.page(query, page_no, page_size),
+                     use_container_width=True, height=420)
+        first = page_no * page_size
+        st.caption(f"Строки {min(first + 1, total):,}–"
+                   f"{min(first + page_size, total):,} из {total:,}")
+
+    download(backend, query, total, f"subscriptions_{d_from}_{d_to}")
+
+
+@fragment("page")
+def page(backend: Backend | None, snap: Snapshot | None, d_from: date,
+         d_to: date) -> Panels:
+    """Filters and everything they drive; changing a filter reruns only this.
+
+    Served from snap when it holds the selection, else from the backend,
+    loaded here when the page started from the snapshot.
+    """
+    options = snap.options.get if snap is not None else backend.options
+    with st.sidebar:
+        cities = [c for c in options("city_id") if str(c).strip()]
+        sel_city = st.selectbox("Город", [ALL] + cities)
+
+        tariffs = options("provaider_tariff_name")
+        sel_tariff = st.selectbox("Тариф", [ALL] + tariffs)
+
+        sub_types = options("subscription_type")
+        sel_type = st.selectbox("Тип подписки", [ALL] + sub_types)
+
+        managers = [m for m in options("manager_id") if str(m).strip()]
+        sel_manager = (st.selectbox("Менеджер", [ALL] + managers)
+                       if managers else ALL)
+
+        billing_periods = options("billing_period")
+        sel_billing = st.selectbox("Биллинг", [ALL] + billing_periods)
+
+        approximate = st.toggle(
+            "Приближённо",
+            help=f"Уникальные абоненты по HyperLogLog: ошибка около "
+                 f"±{hll_error():.1%}. Счётчики топ-10 могут быть занижены "
+                 f"не более чем на 1/{HH_COUNTERS + 1} числа подписок.")
+
+    # ── Apply filters ────────────────────────────────────────────────────────
+    filters = {col: sel for col, sel in zip(
+        DIMENSIONS, [sel_city, sel_tariff, sel_type, sel_manager, sel_billing])
+        if sel != ALL}
+    key = filter_key(filters)
+    precomputed = snap is not None and not approximate and key in snap.panels
+    if precomputed:
+        p, a = snap.panels[key], snap.activity[key]
+        # Versions count installs per process, so the snapshot's may name
+        # different data in this one; its figures are kept apart.
+        state = ("snapshot", snap.created, key, approximate)
+        # The snapshot's active base runs to the day it was taken.
+        until = min(d_to, date.fromtimestamp(snap.created))
+    else:
+        backend = backend or live(d_from, d_to)
+        p = compute_panels(backend.version, key, approximate, backend)
+        # Nothing is active after today, however far the period reaches.
+        until = min(d_to, date.today())
+        a = compute_activity(backend.version, key, until, backend)
+        state = (backend.version, key, approximate)
+
+    # ── Header ───────────────────────────────────────────────────────────────
+    st.markdown("# Subscriptions")
+    st.markdown(
+        f'<p class="subtitle">{d_from.strftime("%d.%m.%Y")} &mdash; '
+        f'{d_to.strftime("%d.%m.%Y")}'
+        f'&nbsp;&nbsp;&middot;&nbsp;&nbsp;'
+        f'{p.rows} из {snap.rows if snap else backend.rows} записей'
+        + (f'&nbsp;&nbsp;&middot;&nbsp;&nbsp;снимок от '
+           f'{datetime.fromtimestamp(snap.created):%d.%m %H:%M}'
+           if precomputed else '') + '</p>',
+        unsafe_allow_html=True,
+    )
 
-# ─────────────────────────────────────────────────────────────────────────────
-# KPIs
-# ─────────────────────────────────────────────────────────────────────────────
-unique_subs  = filtered["subscriber_id"].nunique()
-total_amount = filtered["amount"].sum()
-avg_bonus    = filtered["procent_bonus_id"].mean()
+    # ── KPIs ─────────────────────────────────────────────────────────────────
+    unique_subs  = f"≈{p.unique_subs}" if p.approximate else p.unique_subs
+    total_amount = p.total_amount
+    avg_bonus    = p.avg_bonus
 
-st.markdown(f"""
+    st.markdown(f"""
 <div class="kpi-row">
   <div class="kpi kpi-a1">
     <div class="kpi-icon">&#9632;</div>
     <div class="kpi-label">Всего подписок</div>
-    <div class="kpi-value">{len(filtered)}</div>
+    <div class="kpi-value">{p.rows}</div>
   </div>
   <div class="kpi kpi-a2">
     <div class="kpi-icon">&#9679;</div>
@@ -387,198 +591,80 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Row 1
-# ─────────────────────────────────────────────────────────────────────────────
-r1a, r1b = st.columns(2, gap="large")
-
-with r1a:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    monthly = filtered.groupby("month").size().reset_index(name="count")
-    fig = px.bar(monthly, x="month", y="count", text="count",
-                 color_discrete_sequence=[ACCENT1])
-    fig.update_traces(textposition="outside", marker_line_width=0,
-                      marker_cornerradius=8)
-    styled(fig, title_text="Подписки по месяцам", xaxis_title="", yaxis_title="")
-    st.plotly_chart(fig, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-with r1b:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    tc = filtered["provaider_tariff_name"].value_counts().reset_index()
-    tc.columns = ["tariff", "count"]
-    fig2 = px.pie(tc, names="tariff", values="count", hole=0.55,
-                  color_discrete_sequence=PALETTE)
-    fig2.update_traces(textposition="inside", textinfo="percent+label",
-                       textfont_size=12)
-    styled(fig2, title_text="По тарифам", showlegend=False)
-    st.plotly_chart(fig2, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Row 2
-# ─────────────────────────────────────────────────────────────────────────────
-r2a, r2b = st.columns(2, gap="large")
-
-with r2a:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    cc = (filtered[filtered["city_id"].str.strip() != ""]["city_id"]
-          .value_counts().reset_index())
-    cc.columns = ["city", "count"]
-    fig3 = px.bar(cc.head(15), x="count", y="city", orientation="h",
-                  text="count", color_discrete_sequence=[ACCENT2])
-    fig3.update_traces(textposition="outside", marker_line_width=0,
-                       marker_cornerradius=8)
-    styled(fig3, title_text="По городам",
-           yaxis=dict(autorange="reversed", showgrid=False),
-           xaxis_title="", yaxis_title="")
-    st.plotly_chart(fig3, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-with r2b:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    tyc = filtered["subscription_type"].value_counts().reset_index()
-    tyc.columns = ["type", "count"]
-    fig4 = px.pie(tyc, names="type", values="count", hole=0.55,
-                  color_discrete_sequence=[ACCENT2, ACCENT3, ACCENT1, ACCENT4])
-    fig4.update_traces(textposition="inside", textinfo="percent+label",
-                       textfont_size=12)
-    styled(fig4, title_text="Тип подписки", showlegend=False)
-    st.plotly_chart(fig4, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Row 3
-# ─────────────────────────────────────────────────────────────────────────────
-r3a, r3b = st.columns(2, gap="large")
-
-with r3a:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    daily = (filtered.groupby(filtered["connection_date"].dt.date)
-             .size().reset_index(name="count"))
-    daily.columns = ["date", "count"]
-    fig5 = go.Figure()
-    fig5.add_trace(go.Scatter(
-        x=daily["date"], y=daily["count"],
-        mode="lines+markers", fill="tozeroy",
-        line=dict(color=ACCENT1, width=2.5, shape="spline"),
-        marker=dict(size=5, color=ACCENT1),
-        fillcolor="rgba(108,92,231,0.07)",
-    ))
-    styled(fig5, title_text="Динамика подключений",
-           xaxis_title="", yaxis_title="")
-    st.plotly_chart(fig5, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+    # ── Charts ───────────────────────────────────────────────────────────────
+    for left, right in [("monthly", "tariffs"), ("cities", "types"),
+                        ("daily", "amount"), ("active", "churn"),
+                        ("managers", "bonus")]:
+        col_a, col_b = st.columns(2, gap="large")
+        for column, chart_id in ((col_a, left), (col_b, right)):
+            with column:
+                if chart_id == "daily":
+                    daily_chart(backend, d_from, d_to, key, p, state)
+                elif chart_id in charts.ACTIVITY_CHARTS:
+                    chart(chart_id, a, (*state, until))
+                else:
+                    chart(chart_id, p, state)
+        if right == "churn":
+            st.caption(f"Активная база и отток — только по подпискам, "
+                       f"подключённым с {d_from:%d.%m.%Y}: абоненты, "
+                       f"подключённые раньше, в них не входят, поэтому база "
+                       f"в начале периода занижена.")
+        st.markdown('<div class="section-divider"></div>',
+                    unsafe_allow_html=True)
 
-with r3b:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    if filtered["amount"].sum() > 0:
-        ma = filtered.groupby("month")["amount"].sum().reset_index()
-        fig6 = px.bar(ma, x="month", y="amount", text="amount",
-                      color_discrete_sequence=[ACCENT3])
-        fig6.update_traces(textposition="outside", texttemplate="%{text:,.0f}",
-                           marker_line_width=0, marker_cornerradius=8)
-        styled(fig6, title_text="Сумма по месяцам",
-               xaxis_title="", yaxis_title="")
-    else:
-        bc = filtered["billing_period"].value_counts().reset_index()
-        bc.columns = ["period", "count"]
-        fig6 = px.bar(bc, x="period", y="count", text="count",
-                      color_discrete_sequence=[ACCENT3])
-        fig6.update_traces(textposition="outside", marker_line_width=0,
-                           marker_cornerradius=8)
-        styled(fig6, title_text="Период биллинга",
-               xaxis_title="", yaxis_title="", showlegend=False)
-    st.plotly_chart(fig6, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+    # ── Top subscribers ──────────────────────────────────────────────────────
+    st.markdown("### Топ-10 абонентов")
+    chart("top", p, state)
+    if p.top_error:
+        st.caption(f"Приближённо: счётчики могут быть занижены "
+                   f"не более чем на {p.top_error:,}")
 
-st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
+    st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Row 4
-# ─────────────────────────────────────────────────────────────────────────────
-r4a, r4b = st.columns(2, gap="large")
+    # ── Table ────────────────────────────────────────────────────────────────
+    st.markdown("### Данные")
+    table(backend, d_from, d_to, filters)
+    return p
 
-with r4a:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    mgr = filtered[filtered["manager_id"].str.strip() != ""]
-    if not mgr.empty:
-        mc = mgr["manager_id"].value_counts().reset_index()
-        mc.columns = ["manager", "count"]
-        fig7 = px.bar(mc.head(10), x="count", y="manager", orientation="h",
-                      text="count", color_discrete_sequence=[ACCENT4])
-        fig7.update_traces(textposition="outside", marker_line_width=0,
-                           marker_cornerradius=8)
-        styled(fig7, title_text="По менеджерам",
-               yaxis=dict(autorange="reversed", showgrid=False),
-               xaxis_title="", yaxis_title="")
-        st.plotly_chart(fig7, use_container_width=True)
-    else:
-        st.markdown(f'<div style="padding:48px;text-align:center;'
-                    f'color:{TEXT_SEC};font-size:0.92rem">'
-                    f'Нет данных по менеджерам</div>',
-                    unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-with r4b:
-    st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-    bonus = filtered[filtered["procent_bonus_id"] > 0]
-    if not bonus.empty:
-        bd = bonus["procent_bonus_id"].value_counts().sort_index().reset_index()
-        bd.columns = ["pct", "count"]
-        fig8 = px.bar(bd, x="pct", y="count", text="count",
-                      color_discrete_sequence=[ACCENT4])
-        fig8.update_traces(textposition="outside", marker_line_width=0,
-                           marker_cornerradius=8)
-        styled(fig8, title_text="Бонусы (%)", xaxis_title="", yaxis_title="")
-    else:
-        day_order = ["Monday", "Tuesday", "Wednesday",
-                     "Thursday", "Friday", "Saturday", "Sunday"]
-        day_labels = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-        dow = (filtered["day_of_week"].value_counts()
-               .reindex(day_order).fillna(0).reset_index())
-        dow.columns = ["day", "count"]
-        dow["label"] = day_labels
-        fig8 = px.bar(dow, x="label", y="count", text="count",
-                      color_discrete_sequence=[ACCENT1])
-        fig8.update_traces(textposition="outside", marker_line_width=0,
-                           marker_cornerradius=8)
-        styled(fig8, title_text="По дням недели",
-               xaxis_title="", yaxis_title="", showlegend=False)
-    st.plotly_chart(fig8, use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
 
-st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
+p = page(backend, snap, d_from, d_to)
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Top subscribers
+# Debug
 # ─────────────────────────────────────────────────────────────────────────────
-st.markdown("### Топ-10 абонентов")
-st.markdown('<div class="chart-wrap">', unsafe_allow_html=True)
-top = (filtered.groupby(["subscriber_id", "subscriber_name"])
-       .size().reset_index(name="subs")
-       .sort_values("subs", ascending=False).head(10))
-fig9 = px.bar(top, x="subs", y="subscriber_name", orientation="h",
-              text="subs", color_discrete_sequence=[ACCENT1])
-fig9.update_traces(textposition="outside", marker_line_width=0,
-                   marker_cornerradius=8)
-styled(fig9, yaxis=dict(autorange="reversed", showgrid=False),
-       xaxis_title="", yaxis_title="", height=400)
-st.plotly_chart(fig9, use_container_width=True)
-st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Table
-# ─────────────────────────────────────────────────────────────────────────────
-st.markdown("### Данные")
-st.dataframe(
-    filtered.drop(columns=["month", "day_of_week"], errors="ignore"),
-    use_container_width=True,
-    height=420,
-)
+with st.sidebar:
+    st.markdown("---")
+    debug = st.toggle("Отладка", key="debug",
+                      help="Время и память по этапам последнего прогона, "
+                           "включая перезапуски фрагментов")
+
+metrics.finish(run, rows=rows, filtered=p.rows, snapshot=snap is not None)
+remember(run, "script")
+
+
+# A fragment rerun alone cannot redraw anything outside it, so the panel
+# polls for the latest run instead, every DEBUG_REFRESH seconds while shown.
+DEBUG_REFRESH = 2
+
+
+@st.fragment(run_every=DEBUG_REFRESH)
+def debug_panel():
+    name, seconds, summary = st.session_state["last_run"]
+    st.caption(f"{name}: {seconds * 1000:,.0f} мс")
+    stages = pd.DataFrame(summary)
+    stages["ms"] = (stages.pop("seconds") * 1000).round(1)
+    for col in ("alloc_bytes", "peak_bytes"):
+        if col in stages:
+            stages[col.replace("_bytes", " MiB")] = \
+                (stages.pop(col) / 2 ** 20).round(2)
+    caches = pd.DataFrame(cache.stats())
+    for col in ("resident_bytes", "budget_bytes"):
+        caches[col.replace("_bytes", " MiB")] = \
+            (caches.pop(col) / 2 ** 20).round(1)
+    st.dataframe(stages, hide_index=True, use_container_width=True)
+    st.dataframe(caches, hide_index=True, use_container_width=True)
+
+
+if debug:
+    with st.sidebar:
+        debug_panel()
@@ -0,0 +1,551 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import requests
+
+from cache import SizedLRU
+from metrics import propagate, stage
+
+API_URL = os.environ.get(
+    "BI_API_URL", "https://1c-lk.uztelecom.uz/a/adm/hs/BI/subscriptions")
+API_AUTH = (os.environ.get("BI_API_USER", "BI"),
+            os.environ.get("BI_API_PASSWORD", "Syxukogepe96"))
+
+# Normalized frame layout: the dtype of every field 1C sends.
+SCHEMA = {
+    "subscription_conection_time": "datetime64[us]",
+    "connection_date": "datetime64[us]",
+    "disconnection_date": "datetime64[us]",
+    "quantity": "int64",
+    "amount": "float64",
+    "procent_bonus_id": "float64",
+    "amount_of_remuneration_id": "float64",
+    "subscriber_id": "category",
+    "subscriber_name": "category",
+    "city_id": "category",
+    "provaider_tariff_name": "category",
+    "subscription_type": "category",
+    "manager_id": "category",
+    "billing_period": "category",
+}
+DATETIME_COLUMNS = [c for c, t in SCHEMA.items() if t.startswith("datetime")]
+NUMERIC_COLUMNS = [c for c, t in SCHEMA.items() if t in ("int64", "float64")]
+TEXT_COLUMNS = [c for c, t in SCHEMA.items() if t == "category"]
+
+# How 1C formats dates, and what it sends for an unset one.
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EMPTY_DATE = "0001-01-01T00:00:00"
+
+# Field the 1C endpoint filters "from"/"to" on; rows are partitioned by its day.
+PARTITION_KEY = "subscription_conection_time"
+
+# Recent days still change upstream, older ones are practically settled.
+HOT_DAYS = int(os.environ.get("BI_HOT_DAYS", 3))
+HOT_TTL = int(os.environ.get("BI_HOT_TTL", 300))
+COLD_TTL = int(os.environ.get("BI_COLD_TTL", 6 * 3600))
+
+# Long ranges are fetched as concurrent windows: "day", "week", "month", a
+# number of days, or "none" for a single request.
+FETCH_WINDOW = os.environ.get("BI_FETCH_WINDOW", "month")
+FETCH_WORKERS = int(os.environ.get("BI_FETCH_WORKERS", 4))
+FETCH_RETRIES = int(os.environ.get("BI_FETCH_RETRIES", 3))
+FETCH_BACKOFF = float(os.environ.get("BI_FETCH_BACKOFF", 1.0))
+FETCH_TIMEOUT = (10, float(os.environ.get("BI_FETCH_TIMEOUT", 300)))
+
+# Rows per typed chunk while streaming a response, and bytes per socket read.
+CHUNK_ROWS = int(os.environ.get("BI_CHUNK_ROWS", 50_000))
+READ_BYTES = 1 << 16
+
+# Bytes of assembled ranges kept ready, on top of the partitions themselves.
+RANGE_CACHE_BYTES = int(os.environ.get("BI_RANGE_CACHE_MB", 1024)) << 20
+
+
+_session_lock = threading.Lock()
+_session = None
+
+
+def session() -> requests.Session:
+    """Keep-alive session shared by all fetches, one pooled slot per worker."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            s.auth = API_AUTH
+            s.verify = False
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=FETCH_WORKERS, pool_block=True)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
+
+
+def stream_range(date_from: date, date_to: date) -> Iterator[pd.DataFrame]:
+    """Typed chunks of the 1C response, yielded while it is still downloading."""
+    with session().get(
+        API_URL,
+        params={"from": f"{date_from}T00:00:00", "to": f"{date_to}T23:59:59"},
+        timeout=FETCH_TIMEOUT, stream=True,
+    ) as resp:
+        resp.raise_for_status()
+        resp.encoding = "utf-8"
+        text = resp.iter_content(READ_BYTES, decode_unicode=True)
+        yield from iter_frames(iter_records(text))
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout,
+                          requests.exceptions.ChunkedEncodingError, ValueError))
+
+
+def fetch_window(date_from: date, date_to: date) -> pd.DataFrame:
+    """One window, retried with exponential backoff on transient failures.
+
+    The window's chunks are parsed as they arrive but only returned once it
+    has downloaded completely: 1C does not order rows by day, so no day's
+    partition is whole before then, and a retry must start the window over.
+    Memory peaks at the window's frame plus one chunk, not the raw response;
+    the page sees the rows once every window of its range is in.
+    """
+    with stage("fetch"):
+        for attempt in range(FETCH_RETRIES + 1):
+            try:
+                return concat(list(stream_range(date_from, date_to)))
+            except Exception as e:
+                if attempt == FETCH_RETRIES or not _retryable(e):
+                    raise
+                time.sleep(FETCH_BACKOFF * 2 ** attempt * random.uniform(1, 1.5))
+
+
+def windows(date_from: date, date_to: date,
+            window: str = FETCH_WINDOW) -> list[tuple[date, date]]:
+    """Split [from, to] into consecutive fetch windows."""
+    if window == "none":
+        return [(date_from, date_to)] if date_from <= date_to else []
+    out, lo = [], date_from
+    while lo <= date_to:
+        if window == "day":
+            hi = lo
+        elif window == "week":
+            hi = lo + timedelta(days=6 - lo.weekday())
+        elif window == "month":
+            hi = (lo.replace(day=28) + timedelta(days=4)).replace(day=1) \
+                - timedelta(days=1)
+        else:
+            hi = lo + timedelta(days=int(window) - 1)
+        hi = min(hi, date_to)
+        out.append((lo, hi))
+        lo = hi + timedelta(days=1)
+    return out
+
+
+def map_windows(fetch: Callable[[date, date], pd.DataFrame],
+                spans: list[tuple[date, date]],
+                workers: int = FETCH_WORKERS) -> Iterator[tuple[tuple[date, date], pd.DataFrame]]:
+    """Fetch spans with bounded concurrency, yielding results in span order."""
+    if len(spans) <= 1:
+        for span in spans:
+            yield span, fetch(*span)
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(spans))) as pool:
+        futures = [pool.submit(propagate(fetch), *span) for span in spans]
+        try:
+            for span, future in zip(spans, futures):
+                yield span, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+_decoder = json.JSONDecoder()
+_SEP = re.compile(r"[\s,\ufeff]*")
+
+
+def iter_records(pieces: Iterable[str]) -> Iterator[dict]:
+    """Yield the elements of a top-level JSON array as its text arrives.
+
+    Only the unparsed tail of the body is buffered, so memory is bounded by
+    the largest element rather than by the response size.
+    """
+    buf, pos, opened = "", 0, False
+    for piece in pieces:
+        buf = buf[pos:] + piece
+        pos = _SEP.match(buf).end()
+        if not opened:
+            if pos == len(buf):
+                continue
+            if buf[pos] != "[":
+                raise ValueError("expected a JSON array from the 1C endpoint")
+            opened, pos = True, pos + 1
+        while True:
+            pos = _SEP.match(buf, pos).end()
+            if pos == len(buf) or buf[pos] == "]":
+                break
+            try:
+                obj, pos = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break
+            yield obj
+    if not opened or buf[pos:].strip() != "]":
+        raise ValueError("truncated JSON array from the 1C endpoint")
+
+
+def iter_frames(records: Iterable[dict], rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    batch = []
+    for rec in records:
+        batch.append(rec)
+        if len(batch) >= rows:
+            with stage("coerce"):
+                df = normalize(pd.DataFrame(batch))
+            yield df
+            batch = []
+    if batch:
+        with stage("coerce"):
+            df = normalize(pd.DataFrame(batch))
+        yield df
+
+
+def concat(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate normalized frames, merging the category dictionaries."""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return normalize(pd.DataFrame())
+    if len(frames) == 1:
+        return frames[0]
+    columns = frames[0].columns
+    cats = [c for c in columns
+            if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([f.drop(columns=cats) for f in frames], ignore_index=True)
+    for c in cats:
+        df[c] = union([f[c] for f in frames])
+    return df[columns]
+
+
+def union(parts: list[pd.Series]) -> pd.Categorical:
+    """Concatenate categoricals under the sorted union of their categories.
+
+    Recodes once per distinct dictionary rather than once per part: the day
+    partitions read from one month file all share that file's dictionary.
+    """
+    dicts = {}
+    for part in parts:
+        dicts.setdefault(id(part.cat.categories), part.cat.categories)
+    labels = pd.Index(np.unique(np.concatenate(
+        [np.asarray(d, dtype=object) for d in dicts.values()])))
+    remaps = {key: np.append(labels.get_indexer(d), -1)
+              for key, d in dicts.items()}
+    codes = np.concatenate([remaps[id(part.cat.categories)]
+                            [part.cat.codes.to_numpy()] for part in parts])
+    return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(labels),
+                                     validate=False)
+
+
+def categorical(values) -> pd.Categorical:
+    """Dictionary-encode values as strings with sorted categories."""
+    if isinstance(getattr(values, "dtype", None), pd.StringDtype):
+        codes, labels = pd.factorize(values, sort=True)
+        return pd.Categorical.from_codes(
+            codes, dtype=pd.CategoricalDtype(labels), validate=False)
+    codes, uniques = pd.factorize(values)
+    labels, remap = np.unique(np.asarray(uniques, dtype=object).astype(str),
+                              return_inverse=True)
+    codes = np.append(remap, -1)[codes] if len(remap) else codes
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+# A UTC offset after the time of day, to be dropped.
+_OFFSET = re.compile(r"(\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?)"
+                     r"(?:Z|[+-]\d{2}(?::?\d{2})?)$")
+
+
+def _iso8601(strings: pd.Series) -> pd.Series:
+    """Parse any ISO 8601 form at its local wall time, dropping any offset."""
+    local = strings.str.replace(_OFFSET, r"\1", regex=True)
+    return pd.to_datetime(local, format="ISO8601", errors="coerce")
+
+
+def parse_dates(values, dtype: str = "datetime64[us]") -> np.ndarray:
+    """Parse 1C date strings, each distinct string once.
+
+    Strings in DATETIME_FORMAT take the fast path; other ISO 8601 variants
+    are parsed on their own, and EMPTY_DATE or anything unparseable is NaT.
+    A column that is nearly all distinct is parsed row by row instead, as
+    deduplicating it would cost more than it saves.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return np.asarray(values, dtype=dtype)
+    values = pd.Series(values)
+    sample = values.iloc[::max(len(values) // 1024, 1)]
+    if len(values) > 1024 and sample.nunique() > len(sample) // 2:
+        # Nearly every string distinct (timestamps): parse rows directly.
+        parsed = pd.to_datetime(values, format=DATETIME_FORMAT, errors="coerce")
+        other = parsed.isna() & values.notna()
+        if other.any():
+            parsed[other] = _iso8601(values[other])
+        parsed[values == EMPTY_DATE] = pd.NaT
+        return parsed.to_numpy(dtype)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    parsed = pd.to_datetime(uniques, format=DATETIME_FORMAT, errors="coerce")
+    other = parsed.isna()
+    if other.any():
+        parsed[other] = _iso8601(uniques[other])
+    parsed[uniques == EMPTY_DATE] = pd.NaT
+    return np.append(parsed.to_numpy(dtype), np.datetime64("NaT"))[codes]
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Coerce a frame of 1C records to SCHEMA, adding missing fields.
+
+    Also adds `month` (YYYYMM) and `day_of_week` (0 for Monday) of the
+    connection date as integers, -1 where it is missing.
+    """
+    for c, dtype in SCHEMA.items():
+        if c not in df:
+            df[c] = pd.Series(pd.NaT if c in DATETIME_COLUMNS else
+                              0 if c in NUMERIC_COLUMNS else "",
+                              index=df.index)
+        if c in DATETIME_COLUMNS:
+            df[c] = parse_dates(df[c], dtype)
+        elif c in NUMERIC_COLUMNS:
+            values = df[c]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+            df[c] = values.fillna(0).astype(dtype)
+        else:
+            df[c] = categorical(df[c])
+
+    conn = df["connection_date"].to_numpy()
+    missing = np.isnat(conn)
+    months = conn.astype("datetime64[M]").view(np.int64)
+    days = conn.astype("datetime64[D]").view(np.int64)
+    df["month"] = np.where(missing, -1, (1970 + months // 12) * 100
+                           + months % 12 + 1).astype(np.int32)
+    df["day_of_week"] = np.where(missing, -1, (days + 3) % 7).astype(np.int8)
+    return df
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Bytes per row of every column, compact vs decoded to plain strings."""
+    rows = max(len(df), 1)
+    plain = df.astype({c: object for c in df.columns
+                       if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    report = pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "compact": df.memory_usage(deep=True, index=False) / rows,
+        "plain": plain.memory_usage(deep=True, index=False) / rows,
+    })
+    report.loc["total"] = ["", report["compact"].sum(), report["plain"].sum()]
+    return report
+
+
+def partition_days(df: pd.DataFrame, date_from: date, date_to: date) -> pd.Series:
+    """Day each fetched row belongs to, clipped into the requested window."""
+    key = df[PARTITION_KEY].fillna(df["connection_date"]).dt.normalize()
+    lo, hi = pd.Timestamp(date_from), pd.Timestamp(date_to)
+    return key.clip(lo, hi).fillna(lo).dt.date
+
+
+def day_range(date_from: date, date_to: date) -> list[date]:
+    return [date_from + timedelta(days=i)
+            for i in range((date_to - date_from).days + 1)]
+
+
+def runs(days: list[date]) -> list[tuple[date, date]]:
+    """Collapse sorted days into contiguous (first, last) runs."""
+    out = []
+    for d in days:
+        if out and d - out[-1][1] == timedelta(days=1):
+            out[-1] = (out[-1][0], d)
+        else:
+            out.append((d, d))
+    return out
+
+
+def ttl_for(day: date, today: date) -> int:
+    return HOT_TTL if (today - day).days < HOT_DAYS else COLD_TTL
+
+
+class PartitionCache:
+    """Fetched subscriptions kept as day-level partitions.
+
+    A range is assembled from the partitions already held; only days that are
+    missing or past their TTL are requested upstream, one request per
+    contiguous run of such days (split into concurrent windows when the run is
+    long). With a store attached, partitions are also
+    persisted to disk and read back on first use, so a restarted process only
+    fetches what is stale there.
+
+    Fetches are single-flight: a day already being fetched by another thread
+    is waited for rather than requested again, and with a store the fetch of a
+    span happens under the store's lock on its months, after re-reading them,
+    so processes sharing a store directory reuse each other's fetches.
+    """
+
+    def __init__(self, fetch=fetch_window, store=None):
+        self._fetch = fetch
+        self._store = store
+        self._lock = threading.Lock()
+        self._parts: dict[date, tuple[float, int, pd.DataFrame]] = {}
+        self._ranges = SizedLRU("ranges", RANGE_CACHE_BYTES)
+        self._hydrated: set[date] = set()
+        self._inflight: dict[date, threading.Event] = {}
+        self._seq = 0
+        self._empty = normalize(pd.DataFrame())
+
+    def _stale(self, days: list[date], now: float,
+               lead: float = 1.0) -> list[date]:
+        """Days missing or older than lead times their TTL."""
+        today = date.today()
+        out = []
+        for d in days:
+            part = self._parts.get(d)
+            if part is None or now - part[0] >= lead * ttl_for(d, today):
+                out.append(d)
+        return out
+
+    def _install(self, parts: dict[date, tuple[float, pd.DataFrame]]):
+        with self._lock:
+            newer = {d: part for d, part in parts.items()
+                     if d not in self._parts or self._parts[d][0] < part[0]}
+            if not newer:
+                return
+            self._seq += 1
+            for d, (fetched_at, part) in newer.items():
+                self._parts[d] = (fetched_at, self._seq, part)
+
+    def _hydrate(self, days: list[date]):
+        if self._store is None:
+            return
+        with self._lock:
+            months = sorted({d.replace(day=1) for d in days} - self._hydrated)
+            self._hydrated.update(months)
+        for month in months:
+            with stage("store_read"):
+                parts = self._store.read_month(month)
+            self._install(parts)
+
+    def _put(self, date_from: date, date_to: date, df: pd.DataFrame,
+             fetched_at: float):
+        groups = dict(tuple(df.groupby(partition_days(df, date_from, date_to),
+                                       sort=False)))
+        parts = {}
+        for d in day_range(date_from, date_to):
+            part = groups.get(d)
+            part = self._empty if part is None else part.reset_index(drop=True)
+            parts[d] = (fetched_at, part)
+        self._install(parts)
+        if self._store is not None:
+            with stage("store_write"):
+                self._store.write(parts)
+
+    def load(self, date_from: date, date_to: date,
+             wait: bool = True) -> tuple[str, pd.DataFrame]:
+        """(version, frame) for the range; the version changes with its data.
+
+        wait=False serves days held but past their TTL as they are and only
+        fetches the missing ones, for a caller that has the stale days
+        refetched in the background (see refresh.Refresher).
+        """
+        days = day_range(date_from, date_to)
+        self.refresh(date_from, date_to, 1.0 if wait else math.inf)
+        with self._lock:
+            parts = [self._parts[d] for d in days]
+            version = self._version(date_from, date_to)
+
+        def assemble() -> pd.DataFrame:
+            with stage("assemble"):
+                return concat([p[2] for p in parts])
+        # Keyed by version: a superseded frame is never hit again and is the
+        # first to go once the budget is reached.
+        return version, self._ranges.get(version, assemble)
+
+    def version(self, date_from: date, date_to: date, wait: bool = True) -> str:
+        """The range's version once refreshed, without assembling its frame.
+
+        For readers of the store, which then holds every day of the range.
+        wait as for load.
+        """
+        self.refresh(date_from, date_to, 1.0 if wait else math.inf)
+        with self._lock:
+            return self._version(date_from, date_to)
+
+    def stale(self, date_from: date, date_to: date,
+              lead: float = 1.0) -> list[date]:
+        """Days of the range missing or older than lead times their TTL."""
+        days = day_range(date_from, date_to)
+        self._hydrate(days)
+        with self._lock:
+            return self._stale(days, time.time(), lead)
+
+    def _version(self, date_from: date, date_to: date) -> str:
+        seq = max((self._parts[d][1] for d in day_range(date_from, date_to)),
+                  default=0)
+        return f"{date_from}:{date_to}:{seq}"
+
+    def refresh(self, date_from: date, date_to: date, lead: float = 1.0) -> int:
+        """Refetch the range's days older than lead times their TTL.
+
+        lead=1 fetches what has expired, a smaller lead also what is about to,
+        lead=0 the whole range and lead=math.inf only the days not held. New partitions replace the old ones only
+        once fetched, so concurrent loads keep serving the previous data.
+        Returns the number of days fetched.
+        """
+        days = day_range(date_from, date_to)
+        self._hydrate(days)
+        with self._lock:
+            todo = self._stale(days, time.time(), lead)
+        fetched = len(todo)
+        while todo:
+            with self._lock:
+                mine = [d for d in todo if d not in self._inflight]
+                waits = {self._inflight[d] for d in todo if d in self._inflight}
+                for d in mine:
+                    self._inflight[d] = threading.Event()
+            try:
+                spans = [w for lo, hi in runs(mine) for w in windows(lo, hi)]
+                for _ in map_windows(partial(self._sync, lead=lead), spans):
+                    pass
+            finally:
+                with self._lock:
+                    for d in mine:
+                        self._inflight.pop(d).set()
+            for event in waits:
+                event.wait()
+            # A fetch waited for may have failed; take over what it left.
+            with self._lock:
+                todo = [d for d in todo if d not in self._parts]
+        return fetched
+
+    def _sync(self, date_from: date, date_to: date, lead: float):
+        """Fetch and install a span, coordinating with other processes."""
+        if self._store is None:
+            now = time.time()
+            self._put(date_from, date_to, self._fetch(date_from, date_to), now)
+            return
+        days = day_range(date_from, date_to)
+        months = sorted({d.replace(day=1) for d in days})
+        with self._store.lock(months):
+            for month in months:
+                with stage("store_read"):
+                    self._install(self._store.read_month(month))
+            now = time.time()
+            with self._lock:
+                stale = self._stale(days, now, lead)
+            if stale:
+                lo, hi = stale[0], stale[-1]
+                self._put(lo, hi, self._fetch(lo, hi), now)
@@ -0,0 +1,97 @@
+"""Download of the selected rows as CSV, Parquet or XLSX.
+
+Rows are written EXPORT_ROWS at a time into a temporary file, each chunk
+taken straight from the frame by row position (or streamed by the query
+backend), so writing takes memory by the chunk, not by how many rows are
+exported. The finished file is then read whole into Streamlit's media file
+storage to be served, and held there while the download is offered.
+"""
+import codecs
+import io
+import tempfile
+from collections.abc import Iterable, Iterator
+from typing import BinaryIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+EXPORT_ROWS = 50_000
+XLSX_SHEET_ROWS = 1_048_575  # Excel's row limit, less the header
+
+
+def take_chunks(df: pd.DataFrame, rows: np.ndarray, columns: list[str],
+                size: int = EXPORT_ROWS) -> Iterator[pd.DataFrame]:
+    for lo in range(0, len(rows), size):
+        yield df.take(rows[lo:lo + size])[columns]
+
+
+def write_csv(chunks: Iterable[pd.DataFrame], columns: list[str], out: BinaryIO):
+    # UTF-8 with a BOM, so Excel opens the Cyrillic text correctly.
+    out.write(codecs.BOM_UTF8)
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    pd.DataFrame(columns=columns).to_csv(text, index=False)
+    for chunk in chunks:
+        chunk.to_csv(text, header=False, index=False)
+    text.flush()
+    text.detach()
+
+
+def write_parquet(chunks: Iterable[pd.DataFrame], columns: list[str],
+                  out: BinaryIO):
+    """One row group per chunk; the schema is the first chunk's."""
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False,
+                                     schema=writer and writer.schema)
+        if writer is None:
+            writer = pq.ParquetWriter(out, table.schema)
+        writer.write_table(table)
+    if writer is None:
+        pq.write_table(pa.table({c: pa.array([], pa.string()) for c in columns}),
+                       out)
+    else:
+        writer.close()
+
+
+def write_xlsx(chunks: Iterable[pd.DataFrame], columns: list[str], out: BinaryIO):
+    """Write-only workbook, starting a new sheet every XLSX_SHEET_ROWS."""
+    wb = Workbook(write_only=True)
+    ws, left = None, 0
+    for chunk in chunks:
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            if not left:
+                ws = wb.create_sheet(f"Данные {len(wb.worksheets) + 1}")
+                ws.append(columns)
+                left = XLSX_SHEET_ROWS
+            ws.append(values)
+            left -= 1
+    if ws is None:
+        wb.create_sheet("Данные 1").append(columns)
+    wb.save(out)
+
+
+# format: (MIME type, writer)
+FORMATS = {
+    "csv": ("text/csv", write_csv),
+    "parquet": ("application/vnd.apache.parquet", write_parquet),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+             write_xlsx),
+}
+
+
+def export(chunks: Iterable[pd.DataFrame], columns: list[str],
+           fmt: str) -> io.RawIOBase:
+    """The chunks written in fmt to a temporary file, rewound for reading.
+
+    The file is returned unbuffered: download_button takes a raw file, but
+    not the buffered read-write one TemporaryFile opens.
+    """
+    out = tempfile.TemporaryFile()
+    FORMATS[fmt][1](chunks, columns, out)
+    raw = out.detach()
+    raw.seek(0)
+    return raw
@@ -0,0 +1,213 @@
+"""Per-stage timings and allocations of dashboard runs.
+
+A run is started at the top of the script; any code executed on its behalf,
+including fetch worker threads started with `propagate`, records into it with
+`with stage("name"):`. Stages nest, and a parent's figures include its
+children. Finished runs are appended to METRICS_DIR/stages.jsonl and folded
+into a Prometheus text-format file for the node-exporter textfile collector.
+
+A widget inside a fragment reruns only that fragment; such a rerun is a run of
+its own, so full-page and fragment interaction latencies can be compared.
+
+Memory is traced only while some run asks for it: tracemalloc slows all code
+in the process several times over, so it is stopped again when the last
+traced run finishes or is dropped. tracemalloc is process-wide, so traced
+runs of concurrent sessions reset each other's peaks and their peak figures
+are only trustworthy when one traced run is in progress.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_DIR = Path(os.environ.get("BI_METRICS_DIR", "metrics"))
+ENABLED = os.environ.get("BI_METRICS", "1") != "0"
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current: contextvars.ContextVar["Run | None"] = contextvars.ContextVar(
+    "bi_metrics_run", default=None)
+
+
+class Run:
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.untrace: weakref.finalize | None = None
+        self.started = time.time()
+        self.stages: list[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            frame = [base, base]
+            stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {"stage": name, "seconds": time.perf_counter() - start}
+            if tracing:
+                stack.pop()
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, frame[1])
+                entry["alloc_bytes"] = current - base
+                entry["peak_bytes"] = peak - base
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], peak)
+            with self._lock:
+                self.stages.append(entry)
+
+    def summary(self) -> list[dict]:
+        """Stages merged by name: calls, total seconds, largest peak."""
+        out: dict[str, dict] = {}
+        for s in self.stages:
+            agg = out.setdefault(s["stage"], {"stage": s["stage"], "calls": 0,
+                                              "seconds": 0.0})
+            agg["calls"] += 1
+            agg["seconds"] += s["seconds"]
+            for key in ("alloc_bytes", "peak_bytes"):
+                if key in s:
+                    agg[key] = max(agg.get(key, 0), s[key])
+        return list(out.values())
+
+
+_tracing_lock = threading.Lock()
+_traced_runs = 0
+
+
+def _trace():
+    global _traced_runs
+    with _tracing_lock:
+        _traced_runs += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _untrace():
+    global _traced_runs
+    with _tracing_lock:
+        _traced_runs -= 1
+        if not _traced_runs:
+            tracemalloc.stop()
+
+
+def begin(trace_memory: bool = False) -> Run:
+    """Start a run for the calling thread's context.
+
+    A traced run keeps tracemalloc on until it is finished, or collected if
+    it never is (a script stopped early).
+    """
+    run = Run(trace_memory)
+    if trace_memory:
+        _trace()
+        run.untrace = weakref.finalize(run, _untrace)
+    _current.set(run)
+    return run
+
+
+def current() -> Run | None:
+    """The run of the calling context, if one is in progress."""
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Record the block as a stage of the current run; no-op outside one."""
+    run = _current.get()
+    if run is None:
+        yield
+        return
+    with run.stage(name):
+        yield
+
+
+def propagate(fn):
+    """Wrap fn so it records into the caller's run when called in a thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kw: ctx.run(fn, *args, **kw)
+
+
+_totals_lock = threading.Lock()
+_totals: dict[str, dict] = {}
+_collectors: list = []
+
+
+def collect(fn):
+    """Register fn, returning Prometheus text lines, for the metrics file."""
+    _collectors.append(fn)
+    return fn
+
+
+def finish(run: Run, name: str = "script", **labels):
+    """Append the run to stages.jsonl and refresh the Prometheus file.
+
+    The run's own wall time is recorded as one more stage, called name.
+    """
+    _current.set(None)
+    if run.untrace is not None:
+        run.untrace()
+    if not ENABLED:
+        return
+    elapsed = time.time() - run.started
+    summary = run.summary()
+    with _totals_lock:
+        for s in summary + [{"stage": name, "seconds": elapsed}]:
+            t = _totals.setdefault(s["stage"], {
+                "count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS),
+                "peak_bytes": 0})
+            t["count"] += 1
+            t["sum"] += s["seconds"]
+            for i, bound in enumerate(BUCKETS):
+                if s["seconds"] <= bound:
+                    t["buckets"][i] += 1
+            t["peak_bytes"] = s.get("peak_bytes", t["peak_bytes"])
+        text = _prometheus()
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        with (METRICS_DIR / "stages.jsonl").open("a") as f:
+            f.write(json.dumps({"time": run.started, "pid": os.getpid(),
+                                "run": name, "seconds": round(elapsed, 6),
+                                **labels, "stages": summary}) + "\n")
+        path = METRICS_DIR / f"dashboard-{os.getpid()}.prom"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _prometheus() -> str:
+    lines = [
+        "# HELP bi_dashboard_stage_seconds Time spent per dashboard stage.",
+        "# TYPE bi_dashboard_stage_seconds histogram",
+    ]
+    for name, t in sorted(_totals.items()):
+        for bound, n in zip(BUCKETS, t["buckets"]):
+            lines.append(f'bi_dashboard_stage_seconds_bucket{{stage="{name}",'
+                         f'le="{bound}"}} {n}')
+        lines.append(f'bi_dashboard_stage_seconds_bucket{{stage="{name}",'
+                     f'le="+Inf"}} {t["count"]}')
+        lines.append(f'bi_dashboard_stage_seconds_sum{{stage="{name}"}} {t["sum"]:.6f}')
+        lines.append(f'bi_dashboard_stage_seconds_count{{stage="{name}"}} {t["count"]}')
+    lines += [
+        "# HELP bi_dashboard_stage_peak_bytes Peak traced allocations of the "
+        "last traced run of a stage.",
+        "# TYPE bi_dashboard_stage_peak_bytes gauge",
+    ]
+    for name, t in sorted(_totals.items()):
+        lines.append(f'bi_dashboard_stage_peak_bytes{{stage="{name}"}} {t["peak_bytes"]}')
+    for fn in _collectors:
+        lines += fn()
+    return "\n".join(lines) + "\n"
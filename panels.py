@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from bitmaps import FilterIndex, distinct, top_pairs
+from churn import Activity
+from cube import DIMENSIONS, Cube
+from metrics import stage
+from sketch import Sketches, hh_error
+
+
+@dataclass(frozen=True)
+class Panels:
+    """Every KPI and chart series of the page for one filter selection.
+
+    Series are indexed by the chart's category (month, tariff, day, ...) and
+    hold counts unless the name says otherwise; value-count style series are
+    ordered most frequent first, time series chronologically.
+    """
+    rows: int
+    unique_subs: int
+    total_amount: float
+    avg_bonus: float
+    monthly: pd.Series
+    amount_monthly: pd.Series
+    daily: pd.Series
+    tariffs: pd.Series
+    cities: pd.Series
+    types: pd.Series
+    managers: pd.Series
+    billing: pd.Series
+    bonus: pd.Series
+    weekdays: pd.Series
+    top: pd.DataFrame
+    # Set when unique_subs and top come from sketches; top counts may then be
+    # low by up to top_error.
+    approximate: bool = False
+    top_error: int = 0
+
+
+# Bump whenever Snapshot, Panels or Activity change; older files are ignored.
+SNAPSHOT_FORMAT = 1
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Panels and activity of a period precomputed by snapshot.py.
+
+    Kept here rather than in snapshot.py, which runs as __main__: a class
+    pickled from there could not be loaded by any other process.
+    """
+    created: float
+    date_from: date
+    date_to: date
+    version: str                     # data version it was computed from
+    rows: int
+    options: dict[str, list]         # filter values, as Backend.options
+    panels: dict[tuple, Panels]      # by filter_key
+    activity: dict[tuple, Activity]  # by filter_key
+    format: int = SNAPSHOT_FORMAT
+
+    def covers(self, date_from: date, date_to: date) -> bool:
+        return (self.date_from, self.date_to) == (date_from, date_to)
+
+
+def aggregate(df: pd.DataFrame, cube: Cube, index: FilterIndex,
+              filters: dict, top_n: int = 10,
+              sketches: Sketches | None = None) -> Panels:
+    """Compute all panels in one stage.
+
+    The counts and sums come from a single masked pass over the cube cells
+    (one bincount per dimension); only the distinct-subscriber count and the
+    top subscribers need row data, read through the bitmap index positions,
+    unless they are estimated by merging the cells' sketches.
+    """
+    with stage("filter"):
+        cells = cube.select(filters)
+        rows = None if sketches is not None else index.positions(filters)
+    count = cube.count if cells is None else cube.count[cells]
+    amount = cube.amount if cells is None else cube.amount[cells]
+    bonus = cube.bonus if cells is None else cube.bonus[cells]
+
+    def rollup(column: str, weights: np.ndarray = count) -> pd.Series:
+        codes = cube.codes[column]
+        codes = codes if cells is None else codes[cells]
+        keep = codes >= 0
+        labels = cube.labels[column]
+        n = np.bincount(codes[keep], weights=count[keep], minlength=len(labels))
+        sums = (n if weights is count else
+                np.bincount(codes[keep], weights=weights[keep],
+                            minlength=len(labels)))
+        present = n > 0
+        out = pd.Series(sums[present], index=labels[present], name="count")
+        out.index.name = column
+        return out.astype(np.int64) if weights is count else out
+
+    def ranked(column: str) -> pd.Series:
+        return rollup(column).sort_values(ascending=False, kind="stable")
+
+    total = int(count.sum())
+    with stage("aggregate"):
+        if sketches is None:
+            unique_subs = distinct(df["subscriber_id"], rows)
+            top = top_pairs(df["subscriber_id"], df["subscriber_name"], rows,
+                            top_n)
+        else:
+            unique_subs = sketches.distinct(cells)
+            top = sketches.top(cells, top_n)
+        return Panels(
+            rows=total,
+            unique_subs=unique_subs,
+            total_amount=float(amount.sum()),
+            avg_bonus=bonus.sum() / total if total else float("nan"),
+            monthly=rollup("month"),
+            amount_monthly=rollup("month", amount).rename("amount"),
+            daily=rollup("day"),
+            tariffs=ranked("provaider_tariff_name"),
+            cities=ranked("city_id"),
+            types=ranked("subscription_type"),
+            managers=ranked("manager_id"),
+            billing=ranked("billing_period"),
+            bonus=rollup("procent_bonus_id"),
+            weekdays=rollup("weekday").reindex(range(7), fill_value=0),
+            top=top,
+            approximate=sketches is not None,
+            top_error=0 if sketches is None else hh_error(total),
+        )
+
+
+def hourly(df: pd.DataFrame, rows: np.ndarray | None) -> pd.Series:
+    """Connections per hour of subscription_conection_time, zero-filled.
+
+    Finer than the cube, so counted from the selected rows directly.
+    """
+    hours = df["subscription_conection_time"].to_numpy().astype("datetime64[h]")
+    hours = hours if rows is None else hours[rows]
+    hours = hours[~np.isnat(hours)].view(np.int64)
+    if not len(hours):
+        return pd.Series([], dtype=np.int64, name="count")
+    first = hours.min()
+    n = np.bincount(hours - first)
+    index = pd.DatetimeIndex((first + np.arange(len(n))).astype("datetime64[h]"),
+                             name="hour")
+    return pd.Series(n, index=index, name="count")
+
+
+def filter_key(filters: dict) -> tuple:
+    """Hashable form of a filter selection, in sidebar order."""
+    return tuple(filters.get(column) for column in DIMENSIONS)
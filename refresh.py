@@ -0,0 +1,84 @@
+"""Background refresh of the date ranges viewers are looking at.
+
+Every range passed to `Refresher.touch` stays active for ACTIVE_FOR seconds.
+While it is active, its partitions are refetched once they reach
+REFRESH_LEAD of their TTL, and `warm` is called on the range right away to
+build what its next view needs. A range touched with expired partitions,
+say after a night without viewers, wakes the refresher at once. The viewer
+is meanwhile served the expired partitions, loading with wait=False, and
+only waits for days that are missing altogether.
+
+The dashboard warms the range's frame and query backend (cube, bitmap index
+or DuckDB view); the panels and activity of the new version are still
+computed by the first view that asks for them.
+"""
+import logging
+import threading
+import time
+from collections.abc import Callable
+from datetime import date
+
+from data import PartitionCache
+
+log = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 30  # seconds between passes
+REFRESH_LEAD = 0.8     # refetch a partition at this fraction of its TTL
+ACTIVE_FOR = 1800      # seconds a range stays active after its last view
+
+
+class Refresher:
+    def __init__(self, cache: PartitionCache, interval: float = REFRESH_INTERVAL,
+                 lead: float = REFRESH_LEAD, active_for: float = ACTIVE_FOR,
+                 warm: Callable[[date, date], object] | None = None):
+        self.cache, self.warm = cache, warm
+        self.interval, self.lead, self.active_for = interval, lead, active_for
+        self._active: dict[tuple[date, date], float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bi-refresh",
+                                        daemon=True)
+
+    def start(self) -> "Refresher":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    def touch(self, date_from: date, date_to: date):
+        """Mark a range as being viewed; a new range, or one with expired
+        partitions, is refreshed immediately."""
+        with self._lock:
+            new = (date_from, date_to) not in self._active
+            self._active[(date_from, date_to)] = time.time()
+        if new or self.cache.stale(date_from, date_to):
+            self._wake.set()
+
+    def active(self) -> list[tuple[date, date]]:
+        now = time.time()
+        with self._lock:
+            for key, seen in list(self._active.items()):
+                if now - seen > self.active_for:
+                    del self._active[key]
+            return list(self._active)
+
+    def tick(self):
+        """One pass over the active ranges."""
+        for date_from, date_to in self.active():
+            try:
+                if (self.cache.refresh(date_from, date_to, self.lead)
+                        and self.warm is not None):
+                    self.warm(date_from, date_to)
+            except Exception as e:
+                log.warning("background refresh of %s..%s failed: %s",
+                            date_from, date_to, e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.tick()
+            self._wake.wait(self.interval)
@@ -0,0 +1,156 @@
+"""Precomputed panels of the default period, for an instant first render.
+
+    python snapshot.py                  # once
+    python snapshot.py --every 600      # keep refreshing, every 10 minutes
+
+Loads the period through the partition store like the dashboard does, then
+computes the panels and the active base of the whole selection and of the
+TOP_VALUES most frequent values of each filter. The result is pickled to
+SNAPSHOT_DIR/<time>.pkl and SNAPSHOT_DIR/LATEST is pointed at it atomically.
+The dashboard renders from the latest snapshot when its period matches, and
+falls back to live computation for any other selection.
+"""
+import argparse
+import logging
+import os
+import pickle
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import metrics
+from backend import BACKEND, Backend, DuckDBBackend, PandasBackend
+from cube import DIMENSIONS
+from data import PartitionCache
+from panels import SNAPSHOT_FORMAT, Snapshot, filter_key
+from store import PartitionStore
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path(os.environ.get("BI_SNAPSHOT_DIR", ".bi_snapshots"))
+
+# The dashboard's default period: from DEFAULT_FROM to today.
+DEFAULT_FROM = date(2025, 4, 25)
+TOP_VALUES = 20
+KEEP = 3
+
+# Panels series ranking the values of each filter dimension.
+RANKED = {"city_id": "cities", "provaider_tariff_name": "tariffs",
+          "subscription_type": "types", "manager_id": "managers",
+          "billing_period": "billing"}
+
+
+def build(backend: Backend, date_from: date, date_to: date,
+          top_values: int = TOP_VALUES) -> Snapshot:
+    until = min(date_to, date.today())
+    everything = backend.panels({})
+    selections = [{}] + [
+        {column: value}
+        for column in DIMENSIONS
+        for value in getattr(everything, RANKED[column]).index[:top_values]
+        if str(value).strip()]
+    panels, activity = {}, {}
+    for filters in selections:
+        key = filter_key(filters)
+        with metrics.stage("snapshot_panels"):
+            panels[key] = everything if not filters else backend.panels(filters)
+        with metrics.stage("snapshot_activity"):
+            activity[key] = backend.activity(filters, until)
+    return Snapshot(
+        created=time.time(), date_from=date_from, date_to=date_to,
+        version=backend.version, rows=backend.rows,
+        options={column: backend.options(column) for column in DIMENSIONS},
+        panels=panels, activity=activity)
+
+
+def write(snap: Snapshot, root: Path = SNAPSHOT_DIR, keep: int = KEEP) -> Path:
+    """Store the snapshot, point LATEST at it and drop all but the last keep."""
+    root.mkdir(parents=True, exist_ok=True)
+    path = root / time.strftime("%Y%m%dT%H%M%S.pkl", time.localtime(snap.created))
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as f:
+        pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    pointer = root / "LATEST.tmp"
+    pointer.write_text(path.name)
+    os.replace(pointer, root / "LATEST")
+    for old in sorted(root.glob("*.pkl"))[:-keep]:
+        old.unlink(missing_ok=True)
+    return path
+
+
+def latest_path(root: Path = SNAPSHOT_DIR) -> Path | None:
+    try:
+        return root / (root / "LATEST").read_text().strip()
+    except OSError:
+        return None
+
+
+def read(path: Path) -> Snapshot | None:
+    """The snapshot at path; None when it is missing, unreadable or outdated."""
+    try:
+        with path.open("rb") as f:
+            snap = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        log.warning("ignoring snapshot %s: %s", path, e)
+        return None
+    if getattr(snap, "format", None) != SNAPSHOT_FORMAT:
+        return None
+    return snap
+
+
+def take(cache: PartitionCache, store: PartitionStore, date_from: date,
+         date_to: date, top_values: int, root: Path, keep: int) -> Path:
+    run = metrics.begin()
+    with metrics.stage("load"):
+        if BACKEND == "duckdb":
+            backend = DuckDBBackend(cache.version(date_from, date_to), store,
+                                    date_from, date_to)
+        else:
+            backend = PandasBackend(*cache.load(date_from, date_to))
+    snap = build(backend, date_from, date_to, top_values)
+    path = write(snap, root, keep)
+    metrics.finish(run, name="snapshot", rows=snap.rows,
+                   selections=len(snap.panels))
+    return path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat,
+                        default=DEFAULT_FROM)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat,
+                        help="default: today, as the dashboard")
+    parser.add_argument("--top", type=int, default=TOP_VALUES,
+                        help="most frequent values precomputed per filter")
+    parser.add_argument("--every", type=float,
+                        help="seconds between snapshots; once if unset")
+    parser.add_argument("--dir", type=Path, default=SNAPSHOT_DIR)
+    parser.add_argument("--keep", type=int, default=KEEP)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    store = PartitionStore()
+    cache = PartitionCache(store=store)
+    while True:
+        started = time.time()
+        date_to = args.date_to or date.today()
+        try:
+            path = take(cache, store, args.date_from, date_to, args.top,
+                        args.dir, args.keep)
+            log.info("snapshot %s of %s..%s in %.1fs", path, args.date_from,
+                     date_to, time.time() - started)
+        except Exception as e:
+            if args.every is None:
+                raise
+            log.warning("snapshot of %s..%s failed: %s", args.date_from,
+                        date_to, e)
+        if args.every is None:
+            return 0
+        time.sleep(max(args.every - (time.time() - started), 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
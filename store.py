@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+from contextlib import ExitStack, contextmanager
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data import concat
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+STORE_DIR = Path(os.environ.get("BI_STORE_DIR", ".bi_store"))
+
+# Bump whenever the normalized frame layout changes; older files are ignored.
+SCHEMA_VERSION = 4
+META_KEY = b"bi_partitions"
+# Column holding the partition each row was filed under, for readers that
+# select a range straight from the files.
+DAY_COLUMN = "partition_day"
+
+
+class PartitionStore:
+    """Day partitions persisted as one Parquet file per month.
+
+    Rows are written sorted by day; the file metadata records, per day, when it
+    was fetched and how many rows it holds, so a month is read back with a
+    single memory-mapped read and sliced into days without a groupby. The day
+    is also written as DAY_COLUMN: a row's partition is not always the day of
+    its own dates (see data.partition_days).
+
+    Processes sharing the directory serialize fetch-and-write of a month with
+    `lock`, an exclusive flock on a sidecar file.
+    """
+
+    def __init__(self, root: Path = STORE_DIR):
+        self.root = Path(root)
+
+    def path(self, month: date) -> Path:
+        return self.root / f"{month:%Y-%m}.parquet"
+
+    @contextmanager
+    def lock(self, months: list[date]):
+        """Hold the months' locks, taken in sorted order, for the block."""
+        with ExitStack() as stack:
+            if fcntl is not None:
+                self.root.mkdir(parents=True, exist_ok=True)
+                for month in sorted(months):
+                    f = stack.enter_context(
+                        open(self.root / f"{month:%Y-%m}.lock", "a"))
+                    fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def read_month(self, month: date) -> dict[date, tuple[float, pd.DataFrame]]:
+        path = self.path(month)
+        if not path.exists():
+            return {}
+        try:
+            table = pq.read_table(path, memory_map=True)
+            meta = json.loads(table.schema.metadata[META_KEY])
+        except (OSError, KeyError, ValueError, pa.ArrowException) as e:
+            log.warning("ignoring unreadable store file %s: %s", path, e)
+            return {}
+        if meta.get("version") != SCHEMA_VERSION:
+            return {}
+        df = table.drop_columns([DAY_COLUMN]).to_pandas()
+        out, start = {}, 0
+        for day, fetched_at, rows in meta["days"]:
+            out[date.fromisoformat(day)] = (
+                fetched_at, df.iloc[start:start + rows].reset_index(drop=True))
+            start += rows
+        return out
+
+    def write(self, parts: dict[date, tuple[float, pd.DataFrame]]):
+        by_month: dict[date, dict] = {}
+        for d, part in parts.items():
+            by_month.setdefault(d.replace(day=1), {})[d] = part
+        for month, new in by_month.items():
+            merged = self.read_month(month)
+            for d, part in new.items():
+                if d not in merged or merged[d][0] <= part[0]:
+                    merged[d] = part
+            try:
+                self._write_month(month, merged)
+            except (OSError, pa.ArrowException) as e:
+                log.warning("could not persist %s: %s", self.path(month), e)
+
+    def _write_month(self, month: date, parts: dict):
+        days = sorted(parts)
+        df = concat([parts[d][1] for d in days])
+        table = pa.Table.from_pandas(df, preserve_index=False).append_column(
+            DAY_COLUMN, pa.array(np.repeat(
+                np.array(days, dtype="datetime64[D]"),
+                [len(parts[d][1]) for d in days]), pa.date32()))
+        meta = {"version": SCHEMA_VERSION,
+                "days": [[d.isoformat(), parts[d][0], len(parts[d][1])]
+                         for d in days]}
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), META_KEY: json.dumps(meta)})
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(month)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
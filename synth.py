@@ -0,0 +1,120 @@
+"""Synthetic 1C-shaped subscription records.
+
+Used by bench.py, and runnable as a local stand-in for the 1C endpoint:
+
+    python synth.py serve --port 8600 --rows-per-day 2000
+    BI_API_URL=http://127.0.0.1:8600/hs/BI/subscriptions streamlit run dashboard.py
+"""
+import argparse
+import json
+from collections.abc import Iterator
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+CITIES = ["Ташкент", "Ташкентская обл.", "Самарканд", "Бухара", "Андижан",
+          "Фергана", "Наманган", "Кашкадарья", "Сурхандарья", "Джизак",
+          "Сырдарья", "Навои", "Хорезм", "Нукус", ""]
+SUBSCRIPTION_TYPES = ["Новая", "Продление", "Смена тарифа"]
+BILLING_PERIODS = ["Месяц", "Квартал", "Полгода", "Год"]
+BONUS_PCTS = [0, 0, 0, 5, 10, 15]
+TARIFFS = 60
+MANAGERS = 400
+NO_DATE = "0001-01-01T00:00:00"
+
+
+def _skewed(rng: np.random.Generator, n: int, size: int) -> np.ndarray:
+    """Indices in [0, n) with a Zipf-like skew, as real catalogs have."""
+    weights = 1 / np.arange(1, n + 1)
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def raw_frame(rows: int, start: date = date(2025, 4, 25), days: int = 365,
+              seed: int = 0) -> pd.DataFrame:
+    """Records as the 1C endpoint sends them: every field a string or number.
+
+    About three subscriptions per subscriber, one in three without a manager,
+    a quarter already disconnected.
+    """
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(0, days * 86400, rows)
+    conn = np.datetime64(start, "s") + seconds.astype("timedelta64[s]")
+    conn.sort()
+    disc = conn + rng.integers(1, 400, rows).astype("timedelta64[D]")
+    subscribers = rng.integers(0, max(rows // 3, 1), rows)
+    managers = _skewed(rng, MANAGERS, rows)
+    return pd.DataFrame({
+        "subscription_conection_time": np.datetime_as_string(conn, unit="s"),
+        "connection_date": np.char.add(
+            np.datetime_as_string(conn, unit="D"), "T00:00:00"),
+        "disconnection_date": np.where(
+            rng.random(rows) < 0.25,
+            np.char.add(np.datetime_as_string(disc, unit="D"), "T00:00:00"),
+            NO_DATE),
+        "quantity": 1,
+        "amount": rng.choice([0, 15000, 25000, 35000, 49900], rows),
+        "procent_bonus_id": rng.choice(BONUS_PCTS, rows),
+        "amount_of_remuneration_id": rng.integers(0, 5000, rows),
+        "subscriber_id": (subscribers + 1_000_000).astype(str),
+        "subscriber_name": np.char.add("Абонент ", subscribers.astype(str)),
+        "city_id": np.asarray(CITIES)[_skewed(rng, len(CITIES), rows)],
+        "provaider_tariff_name": np.char.add(
+            "Тариф ", _skewed(rng, TARIFFS, rows).astype(str)),
+        "subscription_type": rng.choice(SUBSCRIPTION_TYPES, rows, p=[.6, .3, .1]),
+        "manager_id": np.where(rng.random(rows) < 1 / 3, "",
+                               np.char.add("M", managers.astype(str))),
+        "billing_period": rng.choice(BILLING_PERIODS, rows, p=[.7, .1, .1, .1]),
+    })
+
+
+def json_pieces(rows: int, chunk_rows: int = 200_000, seed: int = 0,
+                **kw) -> Iterator[str]:
+    """The 1C response body for `rows` records, as a stream of text pieces."""
+    yield "["
+    for i, lo in enumerate(range(0, rows, chunk_rows)):
+        chunk = raw_frame(min(chunk_rows, rows - lo), seed=seed + i, **kw)
+        text = chunk.to_json(orient="records", force_ascii=False)[1:-1]
+        yield ("," if lo else "") + text
+    yield "]"
+
+
+def day_records(day: date, rows: int) -> list[dict]:
+    """Deterministic records for one day, as the stub server returns them."""
+    return raw_frame(rows, start=day, days=1, seed=day.toordinal()) \
+        .to_dict("records")
+
+
+def serve(port: int, rows_per_day: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            lo = datetime.fromisoformat(query["from"][0]).date()
+            hi = datetime.fromisoformat(query["to"][0]).date()
+            records = []
+            while lo <= hi:
+                records += day_records(lo, rows_per_day)
+                lo += timedelta(days=1)
+            body = json.dumps(records, ensure_ascii=False, default=int).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"serving synthetic 1C data on http://127.0.0.1:{server.server_port}"
+          f"/hs/BI/subscriptions")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("serve", help="serve synthetic data over HTTP")
+    cmd.add_argument("--port", type=int, default=8600)
+    cmd.add_argument("--rows-per-day", type=int, default=2000)
+    args = parser.parse_args()
+    serve(args.port, args.rows_per_day)
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+HIDDEN = ["month", "day_of_week"]
+
+
+class TableView:
+    """Server-side paging of the data table.
+
+    Each column's sort order over the whole frame is computed once, on first
+    use, and kept; a page of a filtered, searched, sorted selection is then a
+    masked walk of that order plus a `take` of the visible rows, so neither
+    paging nor changing filters re-sorts anything.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.columns = [c for c in df.columns if c not in HIDDEN]
+        self._orders: dict[tuple[str, bool], np.ndarray] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the sort orders built so far; the frame is not counted."""
+        return sum(a.nbytes for a in list(self._orders.values()))
+
+    def order(self, column: str, descending: bool = False) -> np.ndarray:
+        """Row positions sorted by column, stable, missing values last."""
+        key = (column, descending)
+        if key not in self._orders:
+            s = self.df[column]
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                values, missing = s.cat.codes.to_numpy(), s.isna().to_numpy()
+            elif pd.api.types.is_datetime64_any_dtype(s):
+                values, missing = s.to_numpy().view(np.int64), s.isna().to_numpy()
+            else:
+                values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+                missing = np.isnan(values)
+            values = np.where(missing, 0, values)
+            order = np.lexsort((-values if descending else values, missing))
+            self._orders[key] = order.astype(np.int32 if len(s) < 2 ** 31
+                                             else np.int64)
+        return self._orders[key]
+
+    def search(self, column: str, text: str) -> np.ndarray:
+        """Boolean row mask of values containing text, case-insensitive.
+
+        Only the distinct values are matched; rows follow through their codes.
+        """
+        s = self.df[column]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            codes, uniques = s.cat.codes.to_numpy(), s.cat.categories
+        else:
+            codes, uniques = pd.factorize(s)
+        hits = pd.Index(uniques).astype(str).str.contains(
+            text, case=False, regex=False)
+        return np.append(np.asarray(hits, dtype=bool), False)[codes]
+
+    def rows(self, positions: np.ndarray | None, sort_by: str | None = None,
+             descending: bool = False, column: str | None = None,
+             text: str = "") -> np.ndarray:
+        """Positions of the selection in display order.
+
+        positions restricts to a filtered subset (None for all rows); text,
+        when given, keeps rows whose column contains it.
+        """
+        mask = None
+        if positions is not None:
+            mask = np.zeros(len(self.df), dtype=bool)
+            mask[positions] = True
+        if column and text:
+            found = self.search(column, text)
+            mask = found if mask is None else mask & found
+        if sort_by is None:
+            if mask is None:
+                return np.arange(len(self.df))
+            return np.flatnonzero(mask)
+        order = self.order(sort_by, descending)
+        return order if mask is None else order[mask[order]]
+
+    def page(self, rows: np.ndarray, number: int, size: int) -> pd.DataFrame:
+        """Page `number` (from 0) of rows, as the frame sent to the browser."""
+        return self.df.take(rows[number * size:(number + 1) * size])[self.columns]
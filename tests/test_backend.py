@@ -0,0 +1,45 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import synth
+from backend import DuckDBBackend, PandasBackend, Query
+from data import EMPTY_DATE, PartitionCache, normalize
+from store import PartitionStore
+
+pytest.importorskip("duckdb")
+
+DAY = date(2025, 5, 2)
+
+
+def fetch(date_from: date, date_to: date) -> pd.DataFrame:
+    """A day of records, two of which are not dated within it."""
+    records = synth.day_records(DAY, 10)
+    # Both dates unset: filed under the window's first day.
+    records[0].update(subscription_conection_time=EMPTY_DATE,
+                      connection_date=EMPTY_DATE)
+    # Stamped the day before: clipped into the window.
+    records[1].update(subscription_conection_time="2025-05-01T23:59:00",
+                      connection_date="2025-05-01T00:00:00")
+    return normalize(pd.DataFrame(records))
+
+
+@pytest.fixture
+def backends(tmp_path):
+    store = PartitionStore(tmp_path)
+    version, df = PartitionCache(fetch=fetch, store=store).load(DAY, DAY)
+    return PandasBackend(version, df), DuckDBBackend(version, store, DAY, DAY)
+
+
+def test_backends_select_the_same_rows(backends):
+    pandas_, duckdb_ = backends
+    assert pandas_.rows == duckdb_.rows == 10
+    assert pandas_.panels({}).rows == duckdb_.panels({}).rows == 10
+    assert pandas_.count(Query({})) == duckdb_.count(Query({})) == 10
+
+    def exported(backend):
+        return pd.concat(list(backend.chunks(Query({}, sort_by="subscriber_id")))) \
+            .astype(str).sort_values(list(backend.columns)) \
+            .reset_index(drop=True)
+    pd.testing.assert_frame_equal(exported(pandas_), exported(duckdb_))
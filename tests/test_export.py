@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from openpyxl import load_workbook
+from streamlit.runtime.download_data_util import \
+    convert_data_to_bytes_and_infer_mime
+
+from export import FORMATS, export, take_chunks
+
+COLUMNS = ["subscriber_name", "amount"]
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({"subscriber_name": ["Иванов", "Петров", None, "Сидоров"],
+                         "amount": [10.5, 20.0, 30.25, 40.0],
+                         "city_id": ["1", "2", "3", "4"]})
+
+
+def served(data) -> bytes:
+    """The bytes download_button serves for a deferred download of data."""
+    out, _ = convert_data_to_bytes_and_infer_mime(
+        data, unsupported_error=TypeError(f"unsupported {type(data)}"))
+    return out
+
+
+def read(fmt: str, body: bytes) -> pd.DataFrame:
+    if fmt == "csv":
+        return pd.read_csv(io.BytesIO(body), encoding="utf-8-sig")
+    if fmt == "parquet":
+        return pq.read_table(io.BytesIO(body)).to_pandas()
+    ws = load_workbook(io.BytesIO(body), read_only=True).worksheets[0]
+    header, *rows = ws.iter_rows(values_only=True)
+    return pd.DataFrame(rows, columns=header)
+
+
+@pytest.mark.parametrize("fmt", list(FORMATS))
+def test_export_is_served_by_download_button(frame, fmt):
+    rows = pd.Series([3, 0, 1]).to_numpy()
+    body = served(export(take_chunks(frame, rows, COLUMNS, size=2), COLUMNS, fmt))
+    got = read(fmt, body)
+    assert list(got.columns) == COLUMNS
+    assert got["amount"].tolist() == [40.0, 10.5, 20.0]
+    assert got["subscriber_name"].tolist() == ["Сидоров", "Иванов", "Петров"]
+
+
+@pytest.mark.parametrize("fmt", list(FORMATS))
+def test_export_of_nothing_has_the_header(fmt):
+    got = read(fmt, served(export([], COLUMNS, fmt)))
+    assert list(got.columns) == COLUMNS
+    assert len(got) == 0
@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+import data
+import synth
+from data import PartitionCache, concat, fetch_window, map_windows, windows
+
+ROWS_PER_DAY = 20
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "Stub"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        lo = datetime.fromisoformat(query["from"][0]).date()
+        hi = datetime.fromisoformat(query["to"][0]).date()
+        with self.server.lock:
+            self.server.requests.append((lo, hi))
+            failures = self.server.failures.get(lo)
+            status = failures.pop(0) if failures else None
+            if status is None:
+                self.server.inflight += 1
+                self.server.most = max(self.server.most, self.server.inflight)
+        if status is not None:
+            self.send_error(status)
+            return
+        time.sleep(self.server.delays.get(lo, 0))
+        with self.server.lock:
+            self.server.inflight -= 1
+        records = []
+        while lo <= hi:
+            records += synth.day_records(lo, ROWS_PER_DAY)
+            lo += timedelta(days=1)
+        body = json.dumps(records, ensure_ascii=False, default=int).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Stub(ThreadingHTTPServer):
+    """The 1C endpoint over synth data, failing or stalling on request.
+
+    failures maps a window's first day to the statuses answered, one per
+    request, before it succeeds; delays to seconds spent before answering.
+    most is the largest number of requests answered at once.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.requests: list[tuple[date, date]] = []
+        self.failures: dict[date, list[int]] = {}
+        self.delays: dict[date, float] = {}
+        self.inflight = self.most = 0
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = Stub()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        data, "API_URL",
+        f"http://127.0.0.1:{server.server_port}/hs/BI/subscriptions")
+    monkeypatch.setattr(data, "FETCH_BACKOFF", 0.001)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def days_of(df: pd.DataFrame) -> list[date]:
+    return list(df[data.PARTITION_KEY].dt.date)
+
+
+@pytest.mark.parametrize("window, expected", [
+    ("none", [(date(2025, 1, 30), date(2025, 3, 2))]),
+    ("month", [(date(2025, 1, 30), date(2025, 1, 31)),
+               (date(2025, 2, 1), date(2025, 2, 28)),
+               (date(2025, 3, 1), date(2025, 3, 2))]),
+    # 30.01.2025 is a Thursday; weeks end on Sundays.
+    ("week", [(date(2025, 1, 30), date(2025, 2, 2)),
+              (date(2025, 2, 3), date(2025, 2, 9)),
+              (date(2025, 2, 10), date(2025, 2, 16)),
+              (date(2025, 2, 17), date(2025, 2, 23)),
+              (date(2025, 2, 24), date(2025, 3, 2))]),
+    ("10", [(date(2025, 1, 30), date(2025, 2, 8)),
+            (date(2025, 2, 9), date(2025, 2, 18)),
+            (date(2025, 2, 19), date(2025, 2, 28)),
+            (date(2025, 3, 1), date(2025, 3, 2))]),
+])
+def test_windows_cover_the_range_in_order(window, expected):
+    assert windows(date(2025, 1, 30), date(2025, 3, 2), window) == expected
+
+
+def test_windows_of_days_and_empty_ranges():
+    assert windows(date(2025, 5, 1), date(2025, 5, 3), "day") == [
+        (date(2025, 5, 1), date(2025, 5, 1)),
+        (date(2025, 5, 2), date(2025, 5, 2)),
+        (date(2025, 5, 3), date(2025, 5, 3))]
+    assert windows(date(2025, 5, 2), date(2025, 5, 1), "month") == []
+    assert windows(date(2025, 5, 2), date(2025, 5, 1), "none") == []
+
+
+@pytest.mark.parametrize("statuses", [[500], [503, 502], [429], [429, 503, 500]])
+def test_fetch_window_retries_server_errors_and_throttling(stub, statuses):
+    day = date(2025, 5, 1)
+    stub.failures[day] = list(statuses)
+    df = fetch_window(day, day)
+    assert len(df) == ROWS_PER_DAY
+    assert stub.requests == [(day, day)] * (len(statuses) + 1)
+
+
+def test_fetch_window_gives_up_after_the_last_retry(stub, monkeypatch):
+    monkeypatch.setattr(data, "FETCH_RETRIES", 2)
+    day = date(2025, 5, 1)
+    stub.failures[day] = [503] * 5
+    with pytest.raises(requests.HTTPError) as e:
+        fetch_window(day, day)
+    assert e.value.response.status_code == 503
+    assert len(stub.requests) == 3
+
+
+def test_fetch_window_does_not_retry_client_errors(stub):
+    day = date(2025, 5, 1)
+    stub.failures[day] = [404]
+    with pytest.raises(requests.HTTPError):
+        fetch_window(day, day)
+    assert len(stub.requests) == 1
+
+
+def test_windows_are_concatenated_in_order(stub):
+    date_from, date_to = date(2025, 1, 30), date(2025, 3, 2)
+    spans = windows(date_from, date_to, "week")
+    # The first windows answer last, so completion order is reversed.
+    for i, (lo, _) in enumerate(spans):
+        stub.delays[lo] = 0.05 * (len(spans) - i)
+    results = list(map_windows(fetch_window, spans, workers=len(spans)))
+    assert [span for span, _ in results] == spans
+
+    df = concat([df for _, df in results])
+    whole = fetch_window(date_from, date_to)
+    assert days_of(df) == days_of(whole)
+    assert sorted(days_of(df)) == days_of(df)
+    pd.testing.assert_frame_equal(df.astype(str), whole.astype(str))
+
+
+def test_windows_are_fetched_with_bounded_concurrency(stub):
+    spans = windows(date(2025, 1, 1), date(2025, 1, 12), "day")
+    for lo, _ in spans:
+        stub.delays[lo] = 0.1
+    list(map_windows(fetch_window, spans, workers=3))
+    assert stub.most == 3
+
+
+def test_partial_failure_keeps_the_windows_fetched(stub, monkeypatch):
+    monkeypatch.setattr(data, "FETCH_RETRIES", 1)
+    date_from, date_to = date(2025, 1, 1), date(2025, 3, 31)
+    stub.failures[date(2025, 2, 1)] = [500] * 2
+    cache = PartitionCache()
+    with pytest.raises(requests.HTTPError):
+        cache.load(date_from, date_to)
+    assert (date(2025, 1, 1), date(2025, 1, 31)) in stub.requests
+
+    # The next load asks only for what the failure left out.
+    stub.requests.clear()
+    version, df = cache.load(date_from, date_to)
+    assert (date(2025, 2, 1), date(2025, 2, 28)) in stub.requests
+    assert (date(2025, 1, 1), date(2025, 1, 31)) not in stub.requests
+    assert len(df) == ROWS_PER_DAY * 90
+    assert sorted(days_of(df)) == days_of(df)
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from data import normalize, parse_dates
+
+
+def test_parse_dates_keeps_the_local_wall_time_of_offset_strings():
+    got = parse_dates(["2025-05-01T00:00:00+05:00", "2025-05-01T23:30:00-03:00",
+                       "2025-05-01T10:00:00Z", "2025-05-01T10:00:00.5+0500",
+                       "2025-05-01", "2025-05-01T08:00:00",
+                       "0001-01-01T00:00:00", "not a date"])
+    expected = np.array(["2025-05-01T00:00:00", "2025-05-01T23:30:00",
+                         "2025-05-01T10:00:00", "2025-05-01T10:00:00.5",
+                         "2025-05-01T00:00:00", "2025-05-01T08:00:00",
+                         "NaT", "NaT"], dtype="datetime64[us]")
+    np.testing.assert_array_equal(got, expected)
+
+
+def test_offset_does_not_move_month_or_weekday():
+    df = normalize(pd.DataFrame({
+        "subscription_conection_time": ["2025-05-01T00:00:00+05:00"],
+        "connection_date": ["2025-05-01T00:00:00+05:00"],
+    }))
+    assert df["connection_date"].iloc[0] == pd.Timestamp("2025-05-01")
+    assert df["month"].iloc[0] == 202505
+    assert df["day_of_week"].iloc[0] == 3  # Thursday
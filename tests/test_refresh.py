@@ -0,0 +1,77 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import data
+import synth
+from data import PartitionCache, normalize
+from refresh import Refresher
+
+FROM, TO = date(2025, 5, 1), date(2025, 5, 7)
+
+
+@pytest.fixture
+def fetched():
+    return []
+
+
+@pytest.fixture
+def cache(fetched):
+    def fetch(date_from: date, date_to: date) -> pd.DataFrame:
+        fetched.append((date_from, date_to))
+        records = []
+        for i in range((date_to - date_from).days + 1):
+            records += synth.day_records(date_from + timedelta(days=i), 5)
+        return normalize(pd.DataFrame(records))
+    return PartitionCache(fetch=fetch)
+
+
+@pytest.fixture
+def expire(monkeypatch):
+    def expire():
+        monkeypatch.setattr(data, "HOT_TTL", 0)
+        monkeypatch.setattr(data, "COLD_TTL", 0)
+    return expire
+
+
+def test_expired_days_are_served_without_waiting(cache, fetched, expire):
+    version, df = cache.load(FROM, TO, wait=False)
+    assert fetched == [(FROM, TO)]
+    expire()
+    assert cache.stale(FROM, TO) == data.day_range(FROM, TO)
+    again, held = cache.load(FROM, TO, wait=False)
+    assert fetched == [(FROM, TO)]
+    assert again == version and held is df
+
+
+def test_missing_days_are_still_waited_for(cache, fetched, expire):
+    cache.load(FROM, TO, wait=False)
+    expire()
+    cache.load(FROM, TO + timedelta(days=2), wait=False)
+    assert fetched == [(FROM, TO), (TO + timedelta(days=1), TO + timedelta(days=2))]
+
+
+def test_waiting_load_refetches_expired_days(cache, fetched, expire):
+    version, _ = cache.load(FROM, TO)
+    expire()
+    assert cache.load(FROM, TO)[0] != version
+    assert fetched == [(FROM, TO)] * 2
+
+
+def test_touch_with_expired_days_wakes_the_refresher(cache, fetched, expire):
+    warmed = []
+    refresher = Refresher(cache, warm=lambda lo, hi: warmed.append(
+        cache.load(lo, hi, wait=False)[0]))
+    version, _ = cache.load(FROM, TO, wait=False)
+    refresher.touch(FROM, TO)
+    refresher._wake.clear()
+    refresher.touch(FROM, TO)
+    assert not refresher._wake.is_set()
+
+    expire()
+    refresher.touch(FROM, TO)
+    assert refresher._wake.is_set()
+    refresher.tick()
+    assert fetched == [(FROM, TO)] * 2
+    assert warmed and warmed[0] != version